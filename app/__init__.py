@@ -1,30 +1,27 @@
 import os
 import logging
 
-from flask import Flask, request, render_template
+from flask import Flask, abort, request, render_template, url_for
+from jinja2 import FileSystemBytecodeCache
 
 from config import ProductionConfig, DevelopmentConfig, TestConfig
-from app.db import db, migrate, login_manager, csrf, jwt
+from app.db import (
+    db, migrate, login_manager, csrf, jwt, init_replicas, init_shards,
+    init_sqlite_pragmas,
+)
+from app.cache import FragmentCacheExtension, skip_fragment_cache
+from app.coalescer import init_write_coalescer
+from app.log import init_logging
+from app.metrics import init_metrics
+from app.profiling import init_profiler
+from app.sql_stats import init_sql_stats
+from app.storage import get_storage, init_storage, receipt_variant
+from app.thumbnails import FALLBACK_FORMAT, VARIANT_FORMATS, variant_filename
 
 
 def create_app():
     app = Flask(__name__)
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-        force=True,
-    )
-
-    logger = logging.getLogger("app")
-    logger.info("Social Budget Tracker application starting...")
-    logger.info("Server starting at http://127.0.0.1:5000")
-    logging.getLogger("werkzeug").disabled = True
-
-    logging.getLogger("sqlalchemy").setLevel(logging.WARNING)
-    logging.getLogger("flask_wtf").setLevel(logging.WARNING)
-
     config_name = os.environ.get("FLASK_ENV", "development")
 
     if config_name == "development":
@@ -34,13 +31,39 @@ def create_app():
     else:
         app.config.from_object(TestConfig)
 
+    init_logging(app)
+
+    logger = logging.getLogger("app")
+    logger.info("Social Budget Tracker application starting...")
+    logger.info("Server starting at http://127.0.0.1:5000")
+    logging.getLogger("werkzeug").disabled = True
+
+    logging.getLogger("sqlalchemy").setLevel(logging.WARNING)
+    logging.getLogger("flask_wtf").setLevel(logging.WARNING)
+
     app.config["RESTFUL_JSON"] = {"ensure_ascii": False}
 
     if not os.environ.get("SECRET_KEY", ""):
         raise ValueError("SECRET_KEY must be set in .env file")
 
+    # Скомпилированные шаблоны переживают перезапуск воркеров
+    bytecode_cache_dir = app.config["JINJA_BYTECODE_CACHE_DIR"] or (
+        os.path.join(app.instance_path, "jinja_cache")
+    )
+    os.makedirs(bytecode_cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache.max_entries = (
+        app.config["FRAGMENT_CACHE_MAX_ENTRIES"]
+    )
+
     csrf.init_app(app)
+    init_replicas(app)
+    init_shards(app)
     db.init_app(app)
+    init_sqlite_pragmas(app)
+    init_sql_stats(app)
+    init_metrics(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
     jwt.init_app(app)
@@ -88,11 +111,39 @@ def create_app():
     @app.context_processor
     def utility_processor():
         """Добавляет вспомогательные функции в контекст всех шаблонов."""
-        def get_transaction_image_url(filename):
-            """Возвращает полный URL для изображения транзакции."""
+        def accepted_receipt_formats():
+            """Форматы вариантов чеков, которые клиент объявил в Accept.
+
+            Считается по заголовкам без обращения к хранилищу, поэтому
+            годится в ключ кеша фрагментов.
+            """
+            accepted = set(request.accept_mimetypes.values())
+            return tuple(
+                fmt for fmt, mime_type in VARIANT_FORMATS.items()
+                if mime_type in accepted and fmt != FALLBACK_FORMAT
+            )
+
+        def get_transaction_image_url(filename, size=None):
+            """Возвращает полный URL для изображения транзакции.
+
+            Если указан размер (thumb, medium), выбирается самый легкий
+            готовый вариант в формате, который клиент объявил в Accept,
+            или в FALLBACK_FORMAT. Пока вариантов нет, фрагмент с этим
+            URL не кешируется.
+            """
             if not filename:
                 return None
-            return f"/static/uploads/transactions/{filename}"
+            if size:
+                accepted_types = {
+                    VARIANT_FORMATS[fmt] for fmt in accepted_receipt_formats()
+                }
+                variant = receipt_variant(filename, size, accepted_types)
+                if variant == filename and not get_storage().exists(
+                    variant_filename(filename, size, FALLBACK_FORMAT)
+                ):
+                    skip_fragment_cache()
+                filename = variant
+            return url_for("transactions.receipt", filename=filename)
 
         def transaction_has_image(transaction):
             """Проверяет, есть ли у транзакции изображение."""
@@ -103,16 +154,21 @@ def create_app():
 
         return dict(
             get_transaction_image_url=get_transaction_image_url,
+            accepted_receipt_formats=accepted_receipt_formats,
             transaction_has_image=transaction_has_image,
         )
 
-    # Создаем папку для загрузок при старте приложения
-    with app.app_context():
-        if app.static_folder:
-            uploads_dir = os.path.join(
-                app.static_folder, 'uploads', 'transactions'
-            )
-            os.makedirs(uploads_dir, exist_ok=True)
-            logger.info(f"Папка для загрузок создана: {uploads_dir}")
+    @app.before_request
+    def protect_uploads():
+        """Чеки отдаются только через проверяющий владельца эндпоинт."""
+        if request.endpoint == "static" and (
+            request.path.startswith("/static/uploads/")
+        ):
+            abort(404)
+
+    init_write_coalescer(app)
+    init_profiler(app)
+    storage = init_storage(app)
+    logger.info(f"Хранилище чеков: {storage.name}")
 
     return app
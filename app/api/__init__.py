@@ -5,6 +5,7 @@ from app.api.resources.transactions import TransactionListAPI, TransactionAPI
 from app.api.resources.categories import CategoryListAPI
 from app.api.resources.auth import LoginAPI, RefreshTokenAPI, LogoutAPI
 from app.api.resources.profile import ProfileAPI, ChangePasswordAPI
+from app.api.resources.receipts import ReceiptAPI, ReceiptUploadAPI
 
 api_bp = Blueprint("api_bp", __name__, url_prefix="/api")
 api = Api(api_bp)
@@ -17,3 +18,5 @@ api.add_resource(RefreshTokenAPI, "/auth/refresh")
 api.add_resource(LogoutAPI, "/auth/logout")
 api.add_resource(ProfileAPI, "/profile")
 api.add_resource(ChangePasswordAPI, "/profile/password")
+api.add_resource(ReceiptUploadAPI, "/receipts")
+api.add_resource(ReceiptAPI, "/receipts/<string:filename>")
@@ -10,6 +10,7 @@ from flask_jwt_extended import (
     get_jwt_identity,
 )
 
+from app.log import lazy_extra
 from app.models import User
 from app.api.errors import api_error
 
@@ -17,7 +18,14 @@ logger = logging.getLogger(__name__)
 
 
 def make_extra(user_id=None, data=None):
-    """Хелпер для создания контекста логов."""
+    """Хелпер для создания контекста логов.
+
+    Поля собираются, только если запись действительно попадет в лог.
+    """
+    return lazy_extra(request_extra, user_id, data)
+
+
+def request_extra(user_id, data):
     extra = {
         "endpoint": request.path,
         "method": request.method,
@@ -1,13 +1,19 @@
 import logging
 
+from flask import current_app, request
 from flask_restful import Resource
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from app.models import Category
+from app.repository import add_categories
+from app.api.errors import api_error
 from app.api.resources.auth import make_extra
 
 logger = logging.getLogger(__name__)
 
+# Сколько категорий можно добавить одним запросом
+MAX_CATEGORIES_PER_REQUEST = 1000
+
 
 class CategoryListAPI(Resource):
     @jwt_required()
@@ -17,7 +23,7 @@ class CategoryListAPI(Resource):
             "Запрос списка категорий",
             extra=make_extra(user_id=user_id)
         )
-        categories = Category.query.all()
+        categories = Category.get_all_cached()
         categories_list = [
             {"id": category.id, "name": category.name}
             for category in categories
@@ -33,3 +39,43 @@ class CategoryListAPI(Resource):
             "count": len(categories),
             "categories": categories_list,
         }
+
+    @jwt_required()
+    def post(self):
+        user_id = get_jwt_identity()
+        if int(user_id) not in current_app.config["CATEGORY_ADMIN_IDS"]:
+            logger.warning(
+                "Попытка добавить категории без прав",
+                extra=make_extra(user_id=user_id)
+            )
+            return api_error("У вас недостаточно прав", 403)
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return api_error("Требуются JSON данные", 400)
+        names = data.get("names")
+
+        if not isinstance(names, list) or not names:
+            return api_error("Требуется непустой список names", 400)
+        if len(names) > MAX_CATEGORIES_PER_REQUEST:
+            return api_error(
+                "Слишком много категорий", 400,
+                f"Не больше {MAX_CATEGORIES_PER_REQUEST} за запрос"
+            )
+        invalid = [
+            name for name in names
+            if not isinstance(name, str) or len(name.strip()) > 120
+        ]
+        if invalid:
+            return api_error(
+                "Имя категории должно быть строкой до 120 символов", 400
+            )
+
+        added, existed = add_categories(names)
+        logger.info(
+            "Категории добавлены через API",
+            extra=make_extra(
+                user_id=user_id,
+                data={"added": len(added), "existed": len(existed)}
+            )
+        )
+        return {"added": added, "existed": existed}, 201 if added else 200
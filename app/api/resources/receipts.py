@@ -0,0 +1,79 @@
+import logging
+import re
+
+from flask import current_app, request
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from app.repository import user_owns_receipt
+from app.storage import (
+    EXTENSIONS,
+    get_storage,
+    presign_receipt_upload,
+    send_receipt,
+)
+from app.api.errors import api_error
+from app.api.resources.auth import make_extra
+
+logger = logging.getLogger(__name__)
+
+SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ReceiptUploadAPI(Resource):
+    @jwt_required()
+    def post(self):
+        """Выдает подписанную ссылку для прямой загрузки чека в хранилище."""
+        user_id = int(get_jwt_identity())
+
+        if not get_storage().supports_direct_upload:
+            return api_error(
+                "Прямая загрузка недоступна", 400,
+                "Загрузите файл в поле receipt_image транзакции"
+            )
+
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data, dict):
+            return api_error("Требуются JSON данные", 400)
+
+        sha256 = str(data.get("sha256", "")).lower()
+        content_type = data.get("content_type")
+        try:
+            size = int(data.get("size", 0))
+        except (TypeError, ValueError):
+            size = 0
+
+        if not SHA256_HEX.match(sha256):
+            return api_error("Поле sha256 должно быть hex-строкой", 400)
+        if content_type not in EXTENSIONS:
+            return api_error(
+                "Недопустимый тип файла", 400,
+                f"Допустимые: {', '.join(EXTENSIONS)}"
+            )
+        if not 0 < size <= current_app.config["MAX_CONTENT_LENGTH"]:
+            return api_error("Недопустимый размер файла", 400)
+
+        result = presign_receipt_upload(user_id, sha256, size, content_type)
+        logger.info(
+            "Выдана ссылка для загрузки чека",
+            extra=make_extra(
+                user_id=user_id,
+                data={"filename": result["filename"]}
+            )
+        )
+        return result, 200
+
+
+class ReceiptAPI(Resource):
+    @jwt_required()
+    def get(self, filename):
+        user_id = int(get_jwt_identity())
+
+        if not user_owns_receipt(user_id, filename):
+            logger.warning(
+                "Попытка получить чужой или несуществующий чек",
+                extra=make_extra(user_id=user_id, data={"filename": filename})
+            )
+            return api_error("Файл не найден", 404)
+
+        return send_receipt(filename)
@@ -1,57 +1,26 @@
 import datetime
 import logging
-import os
-import uuid
 
-from flask import request
+from flask import current_app, request, url_for
 from flask_restful import Resource
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from app import db
-from app.models import Transaction, Category
+from app.coalescer import get_write_coalescer
+from app.db import mark_primary_write
+from app.models import ArchivedTransaction, Transaction, Category
+from app.repository import get_user_transaction, needs_archive
+from app.storage import attach_uploaded_receipt, delete_receipt, save_receipt
+from app.uploads import release_receipt
 from app.api.errors import api_error
 from app.api.resources.auth import make_extra
 
 logger = logging.getLogger(__name__)
 
 
-def save_receipt_image_api(file_data, filename):
-    """Сохраняет изображение чека для API и возвращает имя файла."""
-    if not file_data or not filename:
-        return None
-
-    if "." in filename:
-        ext = filename.rsplit(".", 1)[1].lower()
-        if ext not in ["jpg", "jpeg", "png", "gif"]:
-            return None
-    else:
-        return None
-
-    unique_filename = f"{uuid.uuid4()}.{ext}"
-    upload_folder = "app/static/uploads/transactions"
-    os.makedirs(upload_folder, exist_ok=True)
-    filepath = os.path.join(upload_folder, unique_filename)
-
-    try:
-        with open(filepath, "wb") as f:
-            f.write(file_data)
-        return unique_filename
-    except Exception as e:
-        logger.error(f"Ошибка сохранения файла в API: {str(e)}")
-        return None
-
-
-def delete_receipt_image_api(filename):
-    """Удаляет изображение чека для API."""
-    if not filename:
-        return
-
-    filepath = os.path.join("app/static/uploads/transactions", filename)
-    try:
-        if os.path.exists(filepath):
-            os.remove(filepath)
-    except Exception as e:
-        logger.error(f"Ошибка удаления файла {filename} в API: {str(e)}")
+def receipt_image_url(filename):
+    """URL для получения изображения чека через API."""
+    return url_for("api_bp.receiptapi", filename=filename)
 
 
 class TransactionListAPI(Resource):
@@ -74,16 +43,21 @@ class TransactionListAPI(Resource):
         transactions = Transaction.query.filter(
             Transaction.user_id == user_id
         ).all()
+        if needs_archive(user_id):
+            transactions += ArchivedTransaction.query.filter(
+                ArchivedTransaction.user_id == user_id
+            ).all()
         transactions_list = []
         for t in transactions:
             transactions_list.append({
                 "id": t.id,
-                "amount": round(float(t.amount), 2),
+                "amount": t.amount_cents / 100,
                 "type": t.type,
                 "description": t.description,
                 "date": t.date.strftime("%Y-%m-%d %H:%M:%S"),
                 "category": t.category.name if t.category else None,
                 "has_image": t.image_filename is not None,
+                "archived": t.is_archived,
             })
         logger.info(
             "Список транзакций получен",
@@ -171,17 +145,6 @@ class TransactionListAPI(Resource):
             )
             return api_error("Категория не найдена", 400)
 
-        image_filename = None
-        if file and file.filename:
-            file_data = file.read()
-            image_filename = save_receipt_image_api(file_data, file.filename)
-            if image_filename is None:
-                logger.warning(
-                    "Ошибка загрузки изображения в API",
-                    extra=make_extra(user_id=user_id)
-                )
-                return api_error("Ошибка при сохранении изображения", 400)
-
         try:
             if not t_date:
                 t_date = datetime.datetime.utcnow()
@@ -195,7 +158,6 @@ class TransactionListAPI(Resource):
                 date=t_date,
                 category_id=t_category_id,
                 user_id=user_id,
-                image_filename=image_filename,
             )
 
         except Exception as e:
@@ -215,13 +177,58 @@ class TransactionListAPI(Resource):
                 )
             return api_error("Непредвиденная ошибка", 400, f"{str(e)}")
 
+        # Чек сохраняется после всех проверок, чтобы отклоненный запрос
+        # не оставил в хранилище файл без ссылок
+        image_filename = None
+        if file and file.filename:
+            image_filename = save_receipt(file)
+            if image_filename is None:
+                logger.warning(
+                    "Ошибка загрузки изображения в API",
+                    extra=make_extra(user_id=user_id)
+                )
+                return api_error("Ошибка при сохранении изображения", 400)
+        elif data.get("receipt_token"):
+            image_filename = attach_uploaded_receipt(
+                data["receipt_token"], user_id
+            )
+            if image_filename is None:
+                logger.warning(
+                    "Ссылка на незагруженный чек",
+                    extra=make_extra(user_id=user_id)
+                )
+                return api_error("Файл чека не найден", 400)
+        transaction.image_filename = image_filename
+
+        # Без чека строку можно записать групповым коммитом; с чеком
+        # счетчик ссылок должен закоммититься вместе со строкой
+        coalescer = get_write_coalescer() if image_filename is None else None
         try:
-            db.session.add(transaction)
-            db.session.commit()
+            if coalescer:
+                # Закрываем читающую транзакцию запроса, чтобы ее
+                # блокировки не мешали фоновой записи
+                db.session.commit()
+                transaction.id = coalescer.submit(
+                    {
+                        "amount_cents": transaction.amount_cents,
+                        "type": t_type,
+                        "description": t_description,
+                        "date": t_date,
+                        "updated_at": datetime.datetime.utcnow(),
+                        "category_id": t_category_id,
+                        "user_id": user_id,
+                        "image_filename": None,
+                    },
+                    timeout=current_app.config["WRITE_COALESCE_TIMEOUT"],
+                )
+                mark_primary_write()
+            else:
+                db.session.add(transaction)
+                db.session.commit()
         except Exception as e:
             db.session.rollback()
             if image_filename:
-                delete_receipt_image_api(image_filename)
+                delete_receipt(image_filename)
             logger.error(
                 "Ошибка базы данных при создании транзакции",
                 exc_info=True,
@@ -249,7 +256,7 @@ class TransactionListAPI(Resource):
             "message": "Транзакция создана",
             "transaction": {
                 "id": transaction.id,
-                "amount": float(transaction.amount),
+                "amount": transaction.amount_cents / 100,
                 "description": transaction.description,
                 "date": transaction.date.strftime("%Y-%m-%d %H:%M:%S"),
                 "has_image": image_filename is not None,
@@ -257,7 +264,7 @@ class TransactionListAPI(Resource):
         }
 
         if image_filename:
-            image_url = f"/static/uploads/transactions/{image_filename}"
+            image_url = receipt_image_url(image_filename)
             response_data["transaction"]["image_url"] = image_url
 
         return response_data, 201
@@ -273,16 +280,18 @@ class TransactionAPI(Resource):
             extra=make_extra(user_id=user_id, data={"transaction_id": id})
         )
 
-        transaction = Transaction.query.filter_by(id=id).first()
+        transaction, error = get_user_transaction(
+            id, user_id, include_archive=True
+        )
 
-        if not transaction:
+        if error == 404:
             logger.warning(
                 "Транзакция не найдена",
                 extra=make_extra(user_id=user_id, data={"transaction_id": id})
             )
             return api_error("Транзакция не найдена", 404)
 
-        if transaction.user_id != user_id:
+        if error == 403:
             logger.warning(
                 "Попытка доступа к чужой транзакции",
                 extra=make_extra(
@@ -302,7 +311,7 @@ class TransactionAPI(Resource):
 
         response_data = {
             "id": transaction.id,
-            "amount": round(float(transaction.amount), 2),
+            "amount": transaction.amount_cents / 100,
             "type": transaction.type,
             "description": transaction.description,
             "date": transaction.date.strftime("%Y-%m-%d %H:%M:%S"),
@@ -310,10 +319,11 @@ class TransactionAPI(Resource):
                 transaction.category.name if transaction.category else None
             ),
             "has_image": transaction.image_filename is not None,
+            "archived": transaction.is_archived,
         }
 
         if transaction.image_filename:
-            image_url = f"/static/uploads/transactions/{transaction.image_filename}"  # noqa: E501
+            image_url = receipt_image_url(transaction.image_filename)
             response_data["image_url"] = image_url
 
         return {"transaction": response_data}, 200
@@ -327,16 +337,18 @@ class TransactionAPI(Resource):
             extra=make_extra(user_id=user_id, data={"transaction_id": id})
         )
 
-        transaction = Transaction.query.filter_by(id=id).first()
+        transaction, error = get_user_transaction(
+            id, user_id, with_category=False
+        )
 
-        if not transaction:
+        if error == 404:
             logger.warning(
                 "Транзакция для удаления не найдена",
                 extra=make_extra(user_id=user_id, data={"transaction_id": id})
             )
             return api_error("Транзакция не найдена", 404)
 
-        if transaction.user_id != user_id:
+        if error == 403:
             logger.warning(
                 "Попытка удаления чужой транзакции",
                 extra=make_extra(
@@ -344,7 +356,7 @@ class TransactionAPI(Resource):
                     data={
                         "transaction_id": id,
                         "owner_id": transaction.user_id,
-                        "amount": float(transaction.amount),
+                        "amount": transaction.amount_cents / 100,
                         "type": transaction.type,
                     }
                 )
@@ -355,17 +367,18 @@ class TransactionAPI(Resource):
 
         transaction_data = {
             "transaction_id": id,
-            "amount": float(transaction.amount),
+            "amount": transaction.amount_cents / 100,
             "type": transaction.type,
             "had_image": image_filename is not None,
         }
 
         try:
             db.session.delete(transaction)
+            release_receipt(image_filename)
             db.session.commit()
 
             if image_filename:
-                delete_receipt_image_api(image_filename)
+                delete_receipt(image_filename)
 
         except Exception as e:
             db.session.rollback()
@@ -394,15 +407,15 @@ class TransactionAPI(Resource):
             extra=make_extra(user_id=user_id, data={"transaction_id": id})
         )
 
-        transaction = Transaction.query.filter_by(id=id).first()
-        if not transaction:
+        transaction, error = get_user_transaction(id, user_id)
+        if error == 404:
             logger.warning(
                 "Транзакция для обновления не найдена",
                 extra=make_extra(user_id=user_id, data={"transaction_id": id})
             )
             return api_error("Транзакция не найдена", 404)
 
-        if transaction.user_id != user_id:
+        if error == 403:
             logger.warning(
                 "Попытка обновления чужой транзакции",
                 extra=make_extra(
@@ -429,19 +442,6 @@ class TransactionAPI(Resource):
             )
             return api_error("Нет данных для обновления", 400)
 
-        old_image_filename = transaction.image_filename
-        new_image_filename = None
-
-        if file and file.filename:
-            file_data = file.read()
-            new_image_filename = save_receipt_image_api(file_data, file.filename)  # noqa: E501
-            if new_image_filename is not None:
-                transaction.image_filename = new_image_filename
-                if old_image_filename and (
-                    old_image_filename != new_image_filename
-                ):
-                    delete_receipt_image_api(old_image_filename)
-
         if "amount" in data:
             amount = float(data["amount"])
             if amount < 0:
@@ -518,12 +518,37 @@ class TransactionAPI(Resource):
                 )
             transaction.category_id = data["category_id"]
 
+        # Как и при создании, новый чек сохраняется после всех проверок
+        old_image_filename = transaction.image_filename
+        new_image_filename = None
+
+        if file and file.filename:
+            new_image_filename = save_receipt(file)
+        elif data.get("receipt_token"):
+            new_image_filename = attach_uploaded_receipt(
+                data["receipt_token"], user_id
+            )
+            if new_image_filename is None:
+                logger.warning(
+                    "Ссылка на незагруженный чек",
+                    extra=make_extra(
+                        user_id=user_id,
+                        data={"transaction_id": id}
+                    )
+                )
+                return api_error("Файл чека не найден", 400)
+        if new_image_filename is not None:
+            transaction.image_filename = new_image_filename
+            release_receipt(old_image_filename)
+
         try:
             db.session.commit()
+            if new_image_filename:
+                delete_receipt(old_image_filename)
         except Exception as e:
             db.session.rollback()
             if new_image_filename:
-                delete_receipt_image_api(new_image_filename)
+                delete_receipt(new_image_filename)
             logger.error(
                 "Ошибка базы данных при обновлении транзакции",
                 exc_info=True,
@@ -551,7 +576,7 @@ class TransactionAPI(Resource):
 
         response_data = {
             "id": transaction.id,
-            "amount": round(float(transaction.amount), 2),
+            "amount": transaction.amount_cents / 100,
             "type": transaction.type,
             "description": transaction.description,
             "date": transaction.date.strftime("%Y-%m-%d %H:%M:%S"),
@@ -562,7 +587,7 @@ class TransactionAPI(Resource):
         }
 
         if transaction.image_filename:
-            image_url = f"/static/uploads/transactions/{transaction.image_filename}"  # noqa: E501
+            image_url = receipt_image_url(transaction.image_filename)
             response_data["image_url"] = image_url
 
         return {
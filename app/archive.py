@@ -0,0 +1,86 @@
+import gzip
+import json
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow не установлен - доступен только NDJSON
+    pa = None
+
+
+def transaction_record(transaction):
+    """Транзакция в виде словаря для выгрузки в архив.
+
+    Сумма хранится в копейках, как в БД, чтобы архив читался без потерь.
+    """
+    return {
+        "id": transaction.id,
+        "user_id": transaction.user_id,
+        "category_id": transaction.category_id,
+        "type": transaction.type,
+        "amount_cents": transaction.amount_cents,
+        "description": transaction.description,
+        "date": transaction.date.isoformat() if transaction.date else None,
+        "image_filename": transaction.image_filename,
+        "updated_at": (
+            transaction.updated_at.isoformat()
+            if transaction.updated_at else None
+        ),
+    }
+
+
+class NdjsonArchive:
+    """Архив в gzip-сжатом NDJSON: одна транзакция на строку.
+
+    Файл открывается на дозапись, так что повторный запуск после
+    прерывания продолжает тот же архив.
+    """
+
+    def __init__(self, path):
+        self.file = gzip.open(path, "at", encoding="utf-8")
+
+    def write(self, records):
+        for record in records:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetArchive:
+    """Архив в Parquet, каждая пачка - отдельная группа строк.
+
+    В отличие от NDJSON существующий файл перезаписывается.
+    """
+
+    def __init__(self, path):
+        if pa is None:
+            raise RuntimeError("Для архива в Parquet нужен пакет pyarrow")
+        self.schema = pa.schema([
+            ("id", pa.int64()),
+            ("user_id", pa.int64()),
+            ("category_id", pa.int64()),
+            ("type", pa.string()),
+            ("amount_cents", pa.int64()),
+            ("description", pa.string()),
+            ("date", pa.string()),
+            ("image_filename", pa.string()),
+            ("updated_at", pa.string()),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, records):
+        self.writer.write_table(
+            pa.Table.from_pylist(records, schema=self.schema)
+        )
+
+    def close(self):
+        self.writer.close()
+
+
+def open_archive(path):
+    """Открывает архив по расширению: .parquet или NDJSON (.ndjson.gz)."""
+    if path.endswith(".parquet"):
+        return ParquetArchive(path)
+    return NdjsonArchive(path)
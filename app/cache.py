@@ -1,11 +1,22 @@
+import contextvars
+import threading
 import time
+from collections import OrderedDict
 from functools import wraps
 
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from app.metrics import record_cache
+
 GLOBAL_CACHE = {}
 
+# Состояние фрагмента, который сейчас рендерится тегом {% cache %}
+_fragment_state = contextvars.ContextVar("fragment_state", default=None)
+
 
 def make_cache_key(func, *args, **kwargs):
-    func_name = func.__name__
+    func_name = func.__qualname__
     kwargs_tuple = tuple(sorted(kwargs.items()))
     key = (func_name, args, kwargs_tuple)
     return key
@@ -24,10 +35,12 @@ def cache_for(seconds=300, cache_none=False):
             if key in GLOBAL_CACHE:
                 cached_data, timestamp = GLOBAL_CACHE[key]
                 if time.time() - timestamp < seconds:
+                    record_cache(func.__qualname__, True)
                     return cached_data
                 else:
                     del GLOBAL_CACHE[key]
 
+            record_cache(func.__qualname__, False)
             result = func(*args, **kwargs)
             if cache_none or result is not None:
                 GLOBAL_CACHE[key] = (result, time.time())
@@ -35,3 +48,96 @@ def cache_for(seconds=300, cache_none=False):
             return result
         return wrapper
     return decorator
+
+
+def invalidate_cached(func, *args, **kwargs):
+    """Удаляет из кеша результат func для этих аргументов.
+
+    func - функция, обернутая cache_for (можно передать связанный метод
+    класса); аргументы те же, с которыми она вызывалась, включая cls.
+    """
+    func = getattr(func, "__func__", func)
+    func = getattr(func, "__wrapped__", func)
+    key = make_cache_key(func, *args, **kwargs)
+    return GLOBAL_CACHE.pop(key, None) is not None
+
+
+class FragmentCache:
+    """Ограниченный по размеру LRU-кеш отрендеренных фрагментов шаблонов."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+            return fragment
+
+    def set(self, key, fragment):
+        with self._lock:
+            self._fragments[key] = fragment
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja-тег для кеширования фрагментов шаблона.
+
+    {% cache "transaction-row", transaction.id, transaction.updated_at %}
+        ...
+    {% endcache %}
+
+    Ключ должен меняться при каждом изменении данных фрагмента,
+    тогда устаревшие записи просто вытесняются из LRU.
+    """
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        call = self.call_method("_render_cached", [nodes.List(key_parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, key_parts, caller):
+        key = tuple(key_parts)
+        cache = self.environment.fragment_cache
+        fragment = cache.get(key)
+        record_cache("fragment", fragment is not None)
+        if fragment is None:
+            state = {"cacheable": True}
+            token = _fragment_state.set(state)
+            try:
+                fragment = caller()
+            finally:
+                _fragment_state.reset(token)
+            if state["cacheable"]:
+                cache.set(key, fragment)
+        return fragment
+
+
+def skip_fragment_cache():
+    """Не сохранять в кеш фрагмент, который сейчас рендерится.
+
+    Для данных, которые еще не готовы и не отражены в ключе: фрагмент
+    отрендерится заново при следующем запросе.
+    """
+    state = _fragment_state.get()
+    if state is not None:
+        state["cacheable"] = False
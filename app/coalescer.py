@@ -0,0 +1,169 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+
+import sqlalchemy as sa
+from flask import current_app
+
+from app.db import db, shard_key_for, use_shard
+
+logger = logging.getLogger(__name__)
+
+
+class WriteCoalescer:
+    """Групповая запись вставок из параллельных запросов.
+
+    Запросы кладут строки в очередь и ждут результат. Фоновый поток
+    собирает строки в течение window секунд (но не больше max_batch)
+    и вставляет их одним INSERT ... RETURNING с одним коммитом, так что
+    задержку коммита и fsync делят все строки пачки. Если пачка не
+    прошла, строки пишутся по одной: ошибку получает только тот запрос,
+    чья строка ее вызвала.
+    """
+
+    def __init__(self, app, table, window, max_batch, timeout):
+        self.app = app
+        self.table = table
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def submit(self, row, timeout=None):
+        """Вставляет строку в ближайшей пачке и возвращает ее id.
+
+        Ждет не дольше timeout секунд (по умолчанию self.timeout), затем
+        бросает TimeoutError.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        future = Future()
+        self.queue.put((row, future))
+        self.ensure_started()
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            # Строка еще в очереди: снимаем ее, чтобы она не записалась
+            # уже после ответа клиенту об ошибке
+            if future.cancel():
+                raise
+            # Пачка со строкой уже пишется, ждем ее результата
+            return future.result(timeout)
+
+    def ensure_started(self):
+        # Поток не переживает fork, поэтому воркер после fork
+        # запускает свой
+        with self.lock:
+            if self.pid != os.getpid() or not self.thread.is_alive():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(
+                    target=self.run, name="write-coalescer", daemon=True
+                )
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            # Снятые по таймауту строки не пишутся, остальные
+            # становятся неотменяемыми
+            batch = [
+                (row, future) for row, future in batch
+                if future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+            try:
+                with self.app.app_context():
+                    self.write(batch)
+            except Exception as e:
+                # Поток должен пережить любую ошибку, иначе запросы
+                # этой и следующих пачек ждали бы ответа вечно
+                logger.exception("Ошибка групповой записи")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def collect(self):
+        """Ждет первую строку и добирает к ней соседние за window."""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch):
+        try:
+            ids = self.insert([row for row, _ in batch])
+        except Exception:
+            db.session.rollback()
+            logger.warning(
+                "Пачка из %s строк не записана, запись по одной",
+                len(batch),
+            )
+            for row, future in batch:
+                try:
+                    future.set_result(self.insert([row])[0])
+                except Exception as e:
+                    db.session.rollback()
+                    future.set_exception(e)
+            return
+        for (_, future), row_id in zip(batch, ids):
+            future.set_result(row_id)
+
+    def insert(self, rows):
+        """Вставляет строки одной транзакцией, возвращает их id по порядку.
+
+        При шардировании строки группируются по шардам владельцев.
+        """
+        by_shard = defaultdict(list)
+        for index, row in enumerate(rows):
+            by_shard[shard_key_for(row["user_id"])].append(index)
+
+        ids = [None] * len(rows)
+        statement = sa.insert(self.table).returning(
+            self.table.c.id, sort_by_parameter_order=True
+        )
+        for key, indexes in by_shard.items():
+            with use_shard(key=key):
+                result = db.session.execute(
+                    statement, [rows[index] for index in indexes]
+                )
+                for index, row_id in zip(indexes, result.scalars()):
+                    ids[index] = row_id
+        db.session.commit()
+        return ids
+
+
+def init_write_coalescer(app):
+    """Включает групповую запись транзакций, если она разрешена в конфиге."""
+    if not app.config["TRANSACTION_WRITE_COALESCING"]:
+        return None
+    from app.models import Transaction
+
+    coalescer = WriteCoalescer(
+        app,
+        Transaction.__table__,
+        window=app.config["WRITE_COALESCE_WINDOW_MS"] / 1000,
+        max_batch=app.config["WRITE_COALESCE_MAX_BATCH"],
+        timeout=app.config["WRITE_COALESCE_TIMEOUT"],
+    )
+    app.extensions["write_coalescer"] = coalescer
+    return coalescer
+
+
+def get_write_coalescer():
+    """Групповая запись текущего приложения или None, если она выключена."""
+    return current_app.extensions.get("write_coalescer")
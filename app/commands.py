@@ -1,9 +1,11 @@
+import time
+
 import click
 from datetime import timedelta, datetime
 
 from flask import current_app  # noqa: F401, E402
 
-from app.db import db
+from app.db import db, each_shard, shard_key_for, use_shard
 
 
 def register_commands(app):
@@ -14,76 +16,460 @@ def register_commands(app):
         is_flag=True,
         help="Показать что удалит, но не удалять",
     )
-    def cleanup_old_transaction(days, dry_run):
-        """Удаление транзакций старше N дней, по умолчанию - 365"""
-        from app.models import Transaction
+    @click.option(
+        "--batch-size", default=500, help="Транзакций за одну пачку"
+    )
+    @click.option(
+        "--pause", default=0.0, help="Пауза между пачками в секундах"
+    )
+    @click.option(
+        "--archive",
+        "archive_path",
+        default=None,
+        help="Сначала выгрузить в архив: .ndjson.gz или .parquet",
+    )
+    def cleanup_old_transaction(days, dry_run, batch_size, pause,
+                                archive_path):
+        """Удаление транзакций старше N дней, по умолчанию - 365
+
+        Транзакции удаляются пачками, каждая в своей транзакции БД, так что
+        блокировка записи не держится на все время удаления. Старые строки
+        удаляются и из горячей, и из архивной таблицы. Файлы чеков, на
+        которые больше никто не ссылается, удаляются из хранилища.
+        """
+        import sqlalchemy as sa
+        from app.archive import open_archive, transaction_record
+        from app.models import ArchivedTransaction, Transaction
+        from app.storage import delete_receipt
+        from app.uploads import release_receipt
+
+        cutoff_date = datetime.now() - timedelta(days=days)
+        models = (Transaction, ArchivedTransaction)
+
+        def old_rows(model):
+            return model.query.filter(model.date < cutoff_date)
+
+        total = sum(
+            old_rows(model).count() for _ in each_shard() for model in models
+        )
+
+        if not total:
+            click.echo("Транзакций нет")
+            return
+
+        if dry_run:
+            click.echo("Транзакции, которые будут удалены:")
+            for _ in each_shard():
+                for model in models:
+                    for transaction in old_rows(model).order_by(
+                        model.id
+                    ).yield_per(batch_size):
+                        click.echo(
+                            f"{transaction.type} {str(transaction.amount)} "
+                            f"{transaction.date.strftime('%d.%m.%Y %H:%M')}"
+                        )
+            click.echo(f"Всего: {total}")
+            return
+
+        archive = open_archive(archive_path) if archive_path else None
+        deleted = 0
+        started = time.monotonic()
+        try:
+            for _ in each_shard():
+                for model in models:
+                    last_id = 0
+                    while True:
+                        chunk = (
+                            old_rows(model)
+                            .filter(model.id > last_id)
+                            .order_by(model.id)
+                            .limit(batch_size)
+                            .all()
+                        )
+                        if not chunk:
+                            break
+                        last_id = chunk[-1].id
+
+                        if archive:
+                            archive.write(
+                                [transaction_record(t) for t in chunk]
+                            )
+
+                        filenames = [t.image_filename for t in chunk]
+                        db.session.execute(
+                            sa.delete(model).where(
+                                model.id.in_([t.id for t in chunk])
+                            )
+                        )
+                        for filename in filenames:
+                            release_receipt(filename)
+                        db.session.commit()
+
+                        for filename in set(filenames):
+                            delete_receipt(filename)
+
+                        deleted += len(chunk)
+                        elapsed = time.monotonic() - started
+                        rate = deleted / elapsed if elapsed else 0
+                        click.echo(
+                            f"🗑 {deleted}/{total} "
+                            f"({deleted * 100 // total}%), "
+                            f"{rate:.0f} транзакций/с"
+                        )
+                        if pause:
+                            time.sleep(pause)
+        finally:
+            if archive:
+                archive.close()
+
+        click.secho(f"✅ Удалено {str(deleted)} транзакций", fg="green")
+
+    @app.cli.command("archive-transactions")
+    @click.option(
+        "--older-than",
+        "days",
+        default=365,
+        help="Перенести транзакции старше N дней",
+    )
+    @click.option(
+        "--batch-size", default=500, help="Транзакций за одну пачку"
+    )
+    @click.option(
+        "--pause", default=0.0, help="Пауза между пачками в секундах"
+    )
+    def archive_transactions(days, batch_size, pause):
+        """Перенос старых транзакций в архивную таблицу.
+
+        Каждая пачка переносится в своей транзакции БД. Архивные транзакции
+        остаются видны в списках и API, когда период выборки их касается.
+        """
+        from app.repository import archive_transactions_batch
 
         cutoff_date = datetime.now() - timedelta(days=days)
-        query = Transaction.query.filter(Transaction.date < cutoff_date)
-        old_transactions = query.all()
+        moved = 0
+        started = time.monotonic()
+        for _ in each_shard():
+            while True:
+                count = archive_transactions_batch(cutoff_date, batch_size)
+                if not count:
+                    break
+                db.session.commit()
+                moved += count
+                elapsed = time.monotonic() - started
+                rate = moved / elapsed if elapsed else 0
+                click.echo(
+                    f"📦 Перенесено {moved} транзакций, "
+                    f"{rate:.0f} транзакций/с"
+                )
+                if pause:
+                    time.sleep(pause)
+
+        click.secho(f"✅ В архив перенесено {moved} транзакций", fg="green")
+
+    @app.cli.command("migrate-uploads")
+    @click.option(
+        "--batch-size", default=500, help="Файлов за одну пачку"
+    )
+    @click.option(
+        "--pause", default=0.0, help="Пауза между пачками в секундах"
+    )
+    def migrate_uploads(batch_size, pause):
+        """Перенос чеков из плоской папки в шардированную раскладку ab/cd.
+
+        Команду можно прервать и запустить снова: она продолжит с файлов,
+        которые еще лежат в корне папки загрузок.
+        """
+        from app.storage import get_storage
+        from app.uploads import migrate_flat_uploads
+
+        storage = get_storage()
+        if storage.name != "local":
+            click.echo("Перенос нужен только для локального хранилища")
+            return
+        upload_folder = storage.root
+        total = 0
+        while True:
+            moved = migrate_flat_uploads(upload_folder, batch_size)
+            if not moved:
+                break
+            total += moved
+            click.echo(f"📦 Перенесено {total} файлов")
+            if pause:
+                time.sleep(pause)
+
+        click.secho(f"✅ Перенос завершен, всего {total} файлов", fg="green")
+
+    @app.cli.command("gc-receipts")
+    @click.option(
+        "--batch-size", default=500, help="Файлов за одну пачку"
+    )
+    @click.option(
+        "--min-age",
+        default=60,
+        help="Не трогать файлы моложе N минут (идущие загрузки)",
+    )
+    @click.option(
+        "--pause", default=0.0, help="Пауза между пачками в секундах"
+    )
+    @click.option(
+        "--dry-run",
+        is_flag=True,
+        help="Показать что удалит, но не удалять",
+    )
+    def gc_receipts(batch_size, min_age, pause, dry_run):
+        """Удаление файлов чеков, на которые не ссылаются транзакции.
+
+        Также удаляет брошенные временные файлы загрузок и выводит
+        имена из транзакций, файлов для которых нет в хранилище. Список
+        файлов и имена из БД читаются пачками.
+        """
+        from app.storage import (
+            get_storage,
+            find_orphan_receipts,
+            discard_orphan_receipts,
+            find_missing_receipts,
+        )
+
+        storage = get_storage()
+        stale = storage.discard_stale_uploads(min_age * 60, dry_run)
+        for stored in stale:
+            click.echo(f"{stored.filename} {stored.size} байт")
+        if stale:
+            action = "Будет удалено" if dry_run else "Удалено"
+            click.echo(f"🗑 {action} {len(stale)} недописанных загрузок")
 
-        if old_transactions:
+        orphan_count = 0
+        orphan_bytes = 0
+        for orphans in find_orphan_receipts(
+            storage, batch_size, min_age=min_age * 60
+        ):
+            orphan_count += len(orphans)
+            orphan_bytes += sum(stored.size for stored in orphans)
             if dry_run:
-                click.echo("Транзакции, которые будут удалены:")
-                for transaction in old_transactions:
-                    click.echo(
-                        f"{transaction.type} {str(transaction.amount)} "
-                        f"{transaction.date.strftime('%d.%m.%Y %H:%M')}"
-                    )
+                for stored in orphans:
+                    click.echo(f"{stored.filename} {stored.size} байт")
             else:
-                count = query.delete()
+                discard_orphan_receipts(storage, orphans)
+                click.echo(f"🗑 Удалено {orphan_count} файлов")
+            if pause:
+                time.sleep(pause)
+
+        action = "Будет удалено" if dry_run else "Удалено"
+        click.secho(
+            f"✅ {action} {orphan_count} файлов-сирот "
+            f"({orphan_bytes / 1024 / 1024:.1f} МБ)",
+            fg="green",
+        )
+
+        missing_count = 0
+        for missing in find_missing_receipts(storage, batch_size):
+            missing_count += len(missing)
+            for filename in missing:
+                click.echo(f"Нет файла: {filename}")
+        if missing_count:
+            click.secho(
+                f"⚠️ Транзакции ссылаются на {missing_count} "
+                f"отсутствующих файлов",
+                fg="yellow",
+            )
+
+    @app.cli.command("seed")
+    @click.option("--users", default=10, help="Сколько пользователей создать")
+    @click.option(
+        "--transactions-per-user",
+        default=1000,
+        help="Сколько транзакций у каждого пользователя",
+    )
+    @click.option(
+        "--with-images",
+        is_flag=True,
+        help="Прикрепить чеки к части расходов",
+    )
+    @click.option(
+        "--images", default=50, help="Сколько разных чеков сгенерировать"
+    )
+    @click.option(
+        "--image-ratio", default=0.2, help="Доля расходов с чеком"
+    )
+    @click.option("--days", default=730, help="За сколько дней история")
+    @click.option(
+        "--chunk-size", default=10000, help="Строк в одном INSERT"
+    )
+    @click.option(
+        "--workers",
+        default=0,
+        help="Процессов для генерации строк, 0 или 1 - без пула",
+    )
+    @click.option("--password", default="password1", help="Пароль всех")
+    @click.option("--random-seed", default=None, type=int)
+    def seed(users, transactions_per_user, with_images, images, image_ratio,
+             days, chunk_size, workers, password, random_seed):
+        """Заполнение БД реалистичными тестовыми данными.
+
+        Строки вставляются пачками через Core insert(), генерацию можно
+        распараллелить по процессам (--workers). Пользователи получают
+        имена seed<метка>_<N> и один общий пароль.
+        """
+        import random
+        from collections import Counter, defaultdict
+        from concurrent.futures import ProcessPoolExecutor
+        from functools import partial
+
+        import sqlalchemy as sa
+        from werkzeug.security import generate_password_hash
+
+        from app.models import Category, Transaction, User
+        from app.repository import add_categories
+        from app.seed import (
+            CATEGORY_PROFILES,
+            Image,
+            generate_receipt_image,
+            generate_transactions,
+            seed_tasks,
+        )
+        from app.storage import get_storage
+        from app.uploads import acquire_receipt
+
+        rng = random.Random(random_seed)
+        started = time.monotonic()
+        now = datetime.utcnow().replace(microsecond=0)
+
+        add_categories(CATEGORY_PROFILES)
+        category_ids = dict(
+            db.session.execute(
+                sa.select(Category.name, Category.id).where(
+                    Category.name.in_(CATEGORY_PROFILES)
+                )
+            ).all()
+        )
+
+        # Только для тестовых БД: pbkdf2 в одну итерацию не защищает
+        # пароль, зато тысячи пользователей создаются за секунды, а не
+        # за минуты, как со scrypt. Хеш все же считается на каждого
+        # пользователя со своей солью: начальная миграция создала
+        # UNIQUE на user.password_hash, и один общий хеш туда не ляжет
+        prefix = f"seed{rng.randrange(16 ** 6):06x}"
+        user_rows = [
+            {
+                "username": f"{prefix}_{index}",
+                "email": f"{prefix}_{index}@example.com",
+                "password_hash": generate_password_hash(
+                    password, method="pbkdf2:sha256:1"
+                ),
+                "created_at": now,
+            }
+            for index in range(users)
+        ]
+        for start in range(0, len(user_rows), chunk_size):
+            db.session.execute(
+                sa.insert(User.__table__),
+                user_rows[start:start + chunk_size],
+            )
+        db.session.commit()
+        user_ids = db.session.scalars(
+            sa.select(User.id).where(
+                User.username.startswith(f"{prefix}_", autoescape=True)
+            )
+        ).all()
+        click.echo(f"👤 Создано {len(user_ids)} пользователей ({prefix})")
+
+        image_names, image_sizes = [], {}
+        if with_images:
+            if Image is None:
+                raise click.ClickException("Для чеков нужен пакет Pillow")
+            storage = get_storage()
+            for _ in range(images):
+                stored = storage.save(
+                    generate_receipt_image(rng),
+                    current_app.config["MAX_CONTENT_LENGTH"],
+                )
+                if stored.created:
+                    storage.build_variants(stored.filename, stored.path)
+                image_names.append(stored.filename)
+                image_sizes[stored.filename] = stored.size
+            click.echo(f"🧾 Сгенерировано {len(image_names)} чеков")
+
+        tasks = seed_tasks(user_ids, transactions_per_user, chunk_size)
+        generate = partial(
+            generate_transactions,
+            category_ids=category_ids,
+            image_names=image_names,
+            image_ratio=image_ratio,
+            now=now,
+            days=days,
+        )
+        seeds = [rng.randrange(2 ** 32) for _ in tasks]
+        total = users * transactions_per_user
+        inserted = 0
+
+        executor = ProcessPoolExecutor(workers) if workers > 1 else None
+        try:
+            chunks = (executor.map if executor else map)(
+                generate, tasks, seeds
+            )
+            for rows in chunks:
+                by_shard = defaultdict(list)
+                for row in rows:
+                    by_shard[shard_key_for(row["user_id"])].append(row)
+                for key, shard_rows in by_shard.items():
+                    with use_shard(key=key):
+                        db.session.execute(
+                            sa.insert(Transaction.__table__), shard_rows
+                        )
+                # Ссылки на чеки коммитятся вместе со своей пачкой, чтобы
+                # прерванный запуск не оставил счетчики рассинхронными
+                references = Counter(
+                    row["image_filename"] for row in rows
+                    if row["image_filename"]
+                )
+                for filename, count in references.items():
+                    acquire_receipt(filename, image_sizes[filename], count)
                 db.session.commit()
-                click.secho(f"✅ Удалено {str(count)} транзакций", fg="green")
+                inserted += len(rows)
+                elapsed = time.monotonic() - started
+                click.echo(
+                    f"💾 {inserted}/{total} транзакций, "
+                    f"{inserted / elapsed:.0f} строк/с"
+                )
+        finally:
+            if executor:
+                executor.shutdown()
 
-        else:
-            click.echo("Транзакций нет")
+        click.secho(
+            f"✅ Готово за {time.monotonic() - started:.1f} с: "
+            f"{len(user_ids)} пользователей, {inserted} транзакций",
+            fg="green",
+        )
 
     @app.cli.command("add-categories")
     @click.argument("categories", nargs=-1)
+    @click.option(
+        "--file",
+        "-f",
+        "names_file",
+        type=click.File("r", encoding="utf-8"),
+        help="Файл с категориями по одной на строку, '-' - stdin",
+    )
     @click.option("--details", "-d", is_flag=True, help="Детальный вывод")
-    def add_category(categories, details):
-        from app.models import Category
-
-        added = 0
-        existed = 0
-
-        for name in categories:
-            name = name.strip().capitalize()
-            category = Category.query.filter_by(name=name).first()
-            if category:
-                existed += 1
-                if details:
-                    click.echo(
-                        f"⏭️ Категория '{category.name}' уже существует"
-                    )
-            else:
-                added += 1
-                category = Category(name=name)  # type: ignore
-                db.session.add(category)
-                if details:
-                    click.secho(f"✅ Категория {name} добавлена!", fg="green")
+    def add_category(categories, names_file, details):
+        """Добавление категорий из аргументов и/или файла."""
+        from app.repository import add_categories
 
-        db.session.commit()
+        names = list(categories)
+        if names_file:
+            names += names_file.read().splitlines()
 
-        try:
-            from app.cache import GLOBAL_CACHE
-            # Удаляем все записи связанные с Category.get_all_cached
-            keys_to_delete = []
-            for key in GLOBAL_CACHE.keys():
-                if isinstance(key, tuple) and len(key) > 0:
-                    func_name = key[0]  # Первый элемент - имя функции
-                    if func_name == 'get_all_cached':
-                        keys_to_delete.append(key)
-
-            for key in keys_to_delete:
-                del GLOBAL_CACHE[key]
-
-            if keys_to_delete and details:
-                click.echo(
-                    f"🧹 Очищен кеш категорий ({len(keys_to_delete)} записей)")
-        except Exception as e:
-            if details:
-                click.echo(f"⚠️  Ошибка очистки кеша: {e}")
+        added_names, existed_names = add_categories(names)
+        added = len(added_names)
+        existed = len(existed_names)
+
+        if details:
+            for name in existed_names:
+                click.echo(f"⏭️ Категория '{name}' уже существует")
+            for name in added_names:
+                click.secho(f"✅ Категория {name} добавлена!", fg="green")
+            if added:
+                click.echo("🧹 Очищен кеш категорий")
 
         if added > 0:
             click.secho(
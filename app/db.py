@@ -1,11 +1,63 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_migrate import Migrate
-from flask_login import LoginManager
+from flask_login import LoginManager, current_user
 from flask_wtf.csrf import CSRFProtect
-from flask_jwt_extended import JWTManager
+from flask_jwt_extended import JWTManager, get_jwt_identity
+from sqlalchemy.sql.util import find_tables
+
+REPLICA_BIND_PREFIX = "replica_"
+SHARD_BIND_PREFIX = "shard_"
+STICKY_COOKIE = "db_primary_until"
+STICKY_HEADER = "X-DB-Primary-Until"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Шард, явно выбранный через use_shard() (команды, фоновые задачи)
+_current_shard = ContextVar("current_shard", default=None)
+
+# До какого времени пользователь JWT читает из основной БД, по identity.
+# Хранится в процессе, как и остальные кеши приложения
+_primary_until = {}
+_primary_until_lock = threading.Lock()
+PRIMARY_UNTIL_MAX_ENTRIES = 10000
+
+
+class RoutingSession(Session):
+    """Сессия, выбирающая шард, основную БД или реплику.
+
+    Таблицы с info["sharded"] при включенном шардировании читаются и
+    пишутся в шард текущего пользователя. Остальные запросы к основной
+    БД (модели без своего bind) в безопасных методах идут на случайную
+    реплику, одну на весь запрос. Запись - flush или INSERT/UPDATE/DELETE
+    через execute - всегда идет в основную БД и переключает на нее
+    остаток запроса.
+    """
 
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and sharding_enabled() and (
+            is_sharded(mapper, clause)
+        ):
+            return self._db.engines[require_shard_key()]
+        engine = super().get_bind(
+            mapper=mapper, clause=clause, bind=bind, **kwargs
+        )
+        if bind is not None or engine is not self._db.engines.get(None):
+            return engine
+        if self._flushing or isinstance(clause, sa.sql.dml.UpdateBase):
+            mark_primary_write()
+            return engine
+        return current_replica() or engine
 
-db = SQLAlchemy()
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
 login_manager = LoginManager()
 csrf = CSRFProtect()
@@ -14,6 +66,253 @@ login_manager.login_view = "auth.login"  # type: ignore
 login_manager.login_message = "Для доступа необходимо войти в аккаунт!"
 
 
+def dialect_insert(model):
+    """INSERT с поддержкой ON CONFLICT для диалекта БД модели."""
+    if db.session.get_bind(model).dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+
+def init_sqlite_pragmas(app):
+    """Вешает на SQLite-движки приложения выполнение PRAGMA при подключении.
+
+    Набор берется из SQLITE_PRAGMAS конфига. Прагмы действуют на уровне
+    соединения, поэтому выполняются для каждого нового соединения пула.
+    В шардах внешние ключи не проверяются: user и category, на которые
+    они ссылаются, лежат в основной БД.
+    """
+    pragmas = app.config.get("SQLITE_PRAGMAS")
+    if not pragmas:
+        return
+    shards = set(app.extensions.get("db_shards") or ())
+    with app.app_context():
+        engines = list(db.engines.items())
+    for key, engine in engines:
+        if engine.dialect.name != "sqlite":
+            continue
+        if key in shards:
+            sa.event.listen(
+                engine, "connect",
+                sqlite_pragmas_hook({**pragmas, "foreign_keys": "OFF"}),
+            )
+        else:
+            sa.event.listen(engine, "connect", sqlite_pragmas_hook(pragmas))
+
+
+def sqlite_pragmas_hook(pragmas):
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    return set_sqlite_pragmas
+
+
+def init_shards(app):
+    """Регистрирует шарды из SQLALCHEMY_SHARD_URIS как binds shard_N.
+
+    Вызывается до db.init_app. Пользователь попадает в шард
+    user_id % N, поэтому число шардов нельзя менять после появления
+    данных без их переноса.
+    """
+    uris = app.config.get("SQLALCHEMY_SHARD_URIS") or []
+    binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+    keys = []
+    for index, uri in enumerate(uris):
+        key = f"{SHARD_BIND_PREFIX}{index}"
+        binds[key] = uri
+        keys.append(key)
+    app.config["SQLALCHEMY_BINDS"] = binds
+    app.extensions["db_shards"] = keys
+
+
+def sharding_enabled():
+    return bool(current_app.extensions.get("db_shards"))
+
+
+def shard_keys():
+    """Ключи всех шардов; без шардирования - [None] (основная БД)."""
+    return current_app.extensions.get("db_shards") or [None]
+
+
+def shard_key_for(user_id):
+    """Ключ шарда пользователя или None без шардирования."""
+    keys = current_app.extensions.get("db_shards")
+    if not keys:
+        return None
+    return keys[int(user_id) % len(keys)]
+
+
+def is_sharded(mapper, clause):
+    """Затрагивает ли запрос таблицы, разложенные по шардам."""
+    if mapper is not None:
+        return bool(sa.inspect(mapper).local_table.info.get("sharded"))
+    if clause is None:
+        return False
+    return any(
+        table.info.get("sharded")
+        for table in find_tables(clause, include_crud=True)
+    )
+
+
+def require_shard_key():
+    """Шард текущего запроса: явный use_shard() или вошедший пользователь.
+
+    Пользователь берется из JWT в API и из сессии Flask-Login в вебе.
+    """
+    key = _current_shard.get()
+    if key is not None:
+        return key
+    if has_request_context():
+        user_id = jwt_user_id()
+        if user_id is None and current_user.is_authenticated:
+            user_id = current_user.id
+        if user_id is not None:
+            return shard_key_for(user_id)
+    raise RuntimeError(
+        "Запрос к шардированной таблице без пользователя, "
+        "выберите шард через use_shard()"
+    )
+
+
+def jwt_user_id():
+    """identity из проверенного JWT текущего запроса или None."""
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+
+@contextmanager
+def use_shard(user_id=None, key=None):
+    """Направляет запросы к шардированным таблицам в шард пользователя.
+
+    Можно передать и ключ шарда напрямую (key), например при обходе всех
+    шардов. Без шардирования ничего не меняет.
+    """
+    if key is None and user_id is not None:
+        key = shard_key_for(user_id)
+    token = _current_shard.set(key)
+    try:
+        yield key
+    finally:
+        _current_shard.reset(token)
+
+
+def each_shard():
+    """Обходит все шарды (без шардирования - один проход по основной БД).
+
+    После каждого шарда сессия сбрасывает изменения в него и
+    очищается: id в разных шардах совпадают, и объекты из разных шардов
+    не должны встретиться в одной карте идентичности.
+    """
+    keys = shard_keys()
+    for key in keys:
+        with use_shard(key=key):
+            yield key
+            if len(keys) > 1:
+                db.session.flush()
+        if len(keys) > 1:
+            db.session.expunge_all()
+
+
+def init_replicas(app):
+    """Регистрирует реплики из SQLALCHEMY_REPLICA_URIS как binds.
+
+    Вызывается до db.init_app. После записи следующие
+    REPLICA_STICKY_SECONDS секунд запросы клиента читают из основной БД,
+    чтобы видеть свои изменения несмотря на задержку репликации. Клиент
+    получает cookie и заголовок X-DB-Primary-Until, а для пользователя
+    JWT время записи запоминается и на сервере: API-клиенты часто
+    не хранят cookie.
+    """
+    uris = app.config.get("SQLALCHEMY_REPLICA_URIS") or []
+    binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+    keys = []
+    for index, uri in enumerate(uris):
+        key = f"{REPLICA_BIND_PREFIX}{index}"
+        binds[key] = uri
+        keys.append(key)
+    app.config["SQLALCHEMY_BINDS"] = binds
+    app.extensions["db_replicas"] = keys
+    if not keys:
+        return
+
+    @app.after_request
+    def set_sticky_cookie(response):
+        if g.get("db_wrote"):
+            ttl = app.config["REPLICA_STICKY_SECONDS"]
+            until = int(time.time()) + ttl
+            response.set_cookie(
+                STICKY_COOKIE,
+                str(until),
+                max_age=ttl,
+                httponly=True,
+                samesite="Lax",
+            )
+            response.headers[STICKY_HEADER] = str(until)
+            user_id = jwt_user_id()
+            if user_id is not None:
+                remember_primary_write(user_id, until)
+        return response
+
+
+def current_replica():
+    """Движок реплики для текущего запроса или None для основной БД."""
+    if not has_request_context():
+        return None
+    if "db_replica" not in g:
+        g.db_replica = None
+        keys = current_app.extensions.get("db_replicas")
+        if keys and request.method in SAFE_METHODS and not is_sticky():
+            g.db_replica = db.engines[random.choice(keys)]
+    return g.db_replica
+
+
+def remember_primary_write(user_id, until):
+    """Запоминает, что пользователь JWT читает из основной БД до until."""
+    with _primary_until_lock:
+        if len(_primary_until) >= PRIMARY_UNTIL_MAX_ENTRIES:
+            now = time.time()
+            for key, value in list(_primary_until.items()):
+                if value <= now:
+                    del _primary_until[key]
+        _primary_until[user_id] = until
+
+
+def is_sticky():
+    """Клиент недавно писал и должен читать из основной БД.
+
+    Браузер присылает cookie, API-клиент может вернуть заголовок
+    X-DB-Primary-Until. Без них пользователя JWT узнаем по отметке
+    на сервере; она видна только процессу, обработавшему запись.
+    """
+    now = time.time()
+    for value in (
+        request.cookies.get(STICKY_COOKIE),
+        request.headers.get(STICKY_HEADER),
+    ):
+        try:
+            if int(value or 0) > now:
+                return True
+        except ValueError:
+            pass
+    user_id = jwt_user_id()
+    return user_id is not None and _primary_until.get(user_id, 0) > now
+
+
+def mark_primary_write():
+    """Запись в основную БД: до конца запроса читаем только из нее."""
+    if has_request_context():
+        g.db_wrote = True
+        g.db_replica = None
+
+
 @login_manager.user_loader
 def load_user(user_id):
     from app.models import User
@@ -94,6 +94,6 @@ class FilterForm(FlaskForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         from app.models import Category
-        categories = Category.query.all()
+        categories = Category.get_all_cached()
         self.category_id.choices = [
             ("", "Все")] + [(c.id, c.name) for c in categories]  # type: ignore
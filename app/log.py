@@ -0,0 +1,202 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+TEXT_DATEFMT = "%Y-%m-%d %H:%M:%S"
+LAZY_EXTRA = "lazy_extra"
+
+# Атрибуты, которые есть у любой записи; остальные пришли через extra
+RECORD_ATTRS = set(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__
+) | {"message", "asctime", "taskName"}
+
+_handler = None
+_listener = None
+
+
+def lazy_extra(func, *args, **kwargs):
+    """extra для логгера, поля которого считает func(*args, **kwargs).
+
+    func вызывается, только если запись действительно попадет в лог:
+    для выключенного уровня и отброшенных семплированием записей
+    поля не собираются. Вызов происходит в потоке запроса, так что func
+    может читать request и current_user.
+    """
+    return {LAZY_EXTRA: (func, args, kwargs)}
+
+
+def resolve_lazy_extra(record):
+    """Вычисляет отложенные поля extra и переносит их в запись."""
+    lazy = record.__dict__.pop(LAZY_EXTRA, None)
+    if lazy is None:
+        return
+    func, args, kwargs = lazy
+    for key, value in func(*args, **kwargs).items():
+        record.__dict__.setdefault(key, value)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает в лог только долю INFO и DEBUG записей логгера.
+
+    rates - доли по именам логгеров; действует самое длинное совпавшее
+    имя, так что "app.api" задает долю и для "app.api.resources.auth".
+    WARNING и выше не семплируются никогда.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.cache = {}
+
+    def rate_for(self, name):
+        rate = self.cache.get(name)
+        if rate is None:
+            rate = 1.0
+            for prefix in sorted(self.rates, key=len):
+                if name == prefix or name.startswith(prefix + "."):
+                    rate = self.rates[prefix]
+            self.cache[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        rate = self.rate_for(record.name)
+        if rate >= 1.0:
+            return True
+        if random.random() >= rate:
+            return False
+        # По доле можно восстановить настоящее число событий
+        record.sample_rate = rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись, поля extra - на верхнем уровне."""
+
+    def format(self, record):
+        resolve_lazy_extra(record)
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc)
+            .isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        resolve_lazy_extra(record)
+        return super().format(record)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """Передает записи в очередь для записи фоновым потоком.
+
+    В потоке запроса остается только подстановка аргументов сообщения
+    и сбор отложенных extra: объекты запроса и сессии БД нельзя читать
+    из другого потока. Форматирование и запись - в QueueListener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        resolve_lazy_extra(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+        return record
+
+
+def stop_logging():
+    """Дописывает записи из очереди и останавливает фоновый поток."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def start_listener(handler, target):
+    global _listener
+    _listener = QueueListener(
+        handler.queue, target, respect_handler_level=True
+    )
+    _listener.start()
+
+
+def restart_after_fork():
+    # Поток записи не переживает fork, а очередь могла остаться
+    # заблокированной им, поэтому воркер заводит свои
+    if _listener is None:
+        return
+    _handler.queue = queue.SimpleQueue()
+    start_listener(_handler, _listener.handlers[0])
+
+
+def output_handlers():
+    """Обработчики, которые форматируют и пишут записи.
+
+    При LOG_ASYNC это обработчики фонового потока, иначе - обработчик
+    корневого логгера.
+    """
+    if _listener is not None:
+        return list(_listener.handlers)
+    return [_handler] if _handler is not None else []
+
+
+def init_logging(app):
+    """Настраивает корневой логгер по конфигу приложения.
+
+    При LOG_ASYNC запись форматируется и пишется в stderr фоновым
+    потоком, а логгеры лишь кладут ее в очередь. LOG_JSON включает
+    JSON-формат, LOG_SAMPLING - долю INFO-записей по логгерам.
+    """
+    global _handler
+    stop_logging()
+
+    target = logging.StreamHandler()
+    target.setFormatter(
+        JsonFormatter() if app.config["LOG_JSON"]
+        else TextFormatter(TEXT_FORMAT, TEXT_DATEFMT)
+    )
+    handler = target
+    if app.config["LOG_ASYNC"]:
+        handler = AsyncQueueHandler(queue.SimpleQueue())
+        start_listener(handler, target)
+    if app.config["LOG_SAMPLING"]:
+        handler.addFilter(SamplingFilter(app.config["LOG_SAMPLING"]))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+        old.close()
+    root.addHandler(handler)
+    root.setLevel(app.config["LOG_LEVEL"])
+    _handler = handler
+
+
+atexit.register(stop_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=restart_after_fork)
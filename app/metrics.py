@@ -0,0 +1,181 @@
+import hmac
+import logging
+import os
+import time
+
+import sqlalchemy as sa
+from flask import Response, abort, current_app, g, request
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+except ImportError:  # prometheus_client не установлен - метрик нет
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+# Для нескольких воркеров (gunicorn) перед запуском задается
+# PROMETHEUS_MULTIPROC_DIR: значения пишутся в mmap-файлы каталога и
+# суммируются при чтении /metrics любым воркером. Каталог очищается
+# при старте, а в child_exit gunicorn вызывается
+# prometheus_client.multiprocess.mark_process_dead(worker.pid)
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+if prometheus_client is not None:
+    REQUESTS = Counter(
+        "http_requests_total",
+        "HTTP-запросы по эндпоинтам и кодам ответа",
+        ["blueprint", "endpoint", "method", "status"],
+    )
+    REQUEST_LATENCY = Histogram(
+        "http_request_duration_seconds",
+        "Время обработки HTTP-запроса",
+        ["blueprint", "endpoint", "method", "status"],
+    )
+    IN_FLIGHT = Gauge(
+        "http_requests_in_flight",
+        "HTTP-запросы в обработке",
+        multiprocess_mode="livesum",
+    )
+    DB_POOL_CHECKED_OUT = Gauge(
+        "db_pool_checked_out",
+        "Соединения пула, выданные в работу",
+        ["bind"],
+        multiprocess_mode="livesum",
+    )
+    DB_POOL_CONNECTIONS = Gauge(
+        "db_pool_connections",
+        "Открытые соединения пула",
+        ["bind"],
+        multiprocess_mode="livesum",
+    )
+    DB_POOL_CHECKOUTS = Counter(
+        "db_pool_checkouts_total", "Выдачи соединений из пула", ["bind"]
+    )
+    CACHE_REQUESTS = Counter(
+        "cache_requests_total",
+        "Обращения к кешам: result=hit или miss",
+        ["cache", "result"],
+    )
+    UPLOAD_BYTES = Counter(
+        "receipt_upload_bytes_total",
+        "Байты загруженных чеков",
+        ["storage", "via"],
+    )
+    UPLOADS = Counter(
+        "receipt_uploads_total",
+        "Загрузки чеков: created=false - такой файл уже был",
+        ["storage", "via", "created"],
+    )
+
+
+def record_cache(cache, hit):
+    """Учитывает попадание или промах кеша cache."""
+    if prometheus_client is not None:
+        CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_upload(storage, via, size, created):
+    """Учитывает загруженный чек: через приложение или напрямую (direct)."""
+    if prometheus_client is not None:
+        UPLOAD_BYTES.labels(storage, via).inc(size)
+        UPLOADS.labels(storage, via, str(bool(created)).lower()).inc()
+
+
+def watch_pool(engine, bind):
+    """Считает соединения пула движка через события пула."""
+    checked_out = DB_POOL_CHECKED_OUT.labels(bind)
+    connections = DB_POOL_CONNECTIONS.labels(bind)
+    checkouts = DB_POOL_CHECKOUTS.labels(bind)
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checked_out.inc()
+        checkouts.inc()
+
+    def on_checkin(dbapi_connection, connection_record):
+        checked_out.dec()
+
+    def on_connect(dbapi_connection, connection_record):
+        connections.inc()
+
+    def on_close(dbapi_connection, connection_record):
+        connections.dec()
+
+    sa.event.listen(engine, "checkout", on_checkout)
+    sa.event.listen(engine, "checkin", on_checkin)
+    sa.event.listen(engine, "connect", on_connect)
+    sa.event.listen(engine, "close", on_close)
+
+
+def metrics_view():
+    """Отдает метрики в текстовом формате Prometheus."""
+    token = current_app.config["METRICS_TOKEN"]
+    if token:
+        if not hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {token}"
+        ):
+            abort(404)
+    elif not current_app.config["METRICS_PUBLIC"]:
+        abort(404)
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(
+        prometheus_client.generate_latest(registry),
+        mimetype=prometheus_client.CONTENT_TYPE_LATEST,
+    )
+
+
+def init_metrics(app):
+    """Подключает сбор метрик и эндпоинт /metrics.
+
+    Без пакета prometheus_client или с METRICS_ENABLED=False ничего не
+    делает. METRICS_TOKEN, если задан, требуется в Authorization: Bearer;
+    без токена и METRICS_PUBLIC эндпоинт отвечает 404.
+    """
+    if not app.config["METRICS_ENABLED"]:
+        return
+    if prometheus_client is None:
+        logger.warning("prometheus_client не установлен, /metrics отключен")
+        return
+
+    from app.db import db
+
+    with app.app_context():
+        engines = list(db.engines.items())
+    for bind, engine in engines:
+        watch_pool(engine, bind or "default")
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        IN_FLIGHT.inc()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.get("metrics_started")
+        if started is not None:
+            labels = (
+                request.blueprint or "",
+                request.endpoint or "",
+                request.method,
+                str(response.status_code),
+            )
+            REQUESTS.labels(*labels).inc()
+            REQUEST_LATENCY.labels(*labels).observe(
+                time.perf_counter() - started
+            )
+        return response
+
+    @app.teardown_request
+    def finish_request(exc):
+        if g.pop("metrics_started", None) is not None:
+            IN_FLIGHT.dec()
+
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+    if not app.config["METRICS_TOKEN"] and not app.config["METRICS_PUBLIC"]:
+        logger.warning("/metrics закрыт: задайте METRICS_TOKEN")
@@ -1,12 +1,27 @@
 from datetime import datetime
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from typing import List, Optional
 from flask_login import UserMixin
 import sqlalchemy as sa
 import sqlalchemy.orm as so
+from sqlalchemy.ext.hybrid import hybrid_property
 from werkzeug.security import generate_password_hash, check_password_hash
 from app.db import db
-from app.cache import cache_for
+from app.cache import cache_for, invalidate_cached
+
+
+def to_minor_units(value):
+    """Переводит денежную сумму в целое число копеек."""
+    return int(
+        (Decimal(str(value)) * 100).quantize(
+            Decimal("1"), rounding=ROUND_HALF_UP
+        )
+    )
+
+
+def from_minor_units(cents):
+    """Переводит целое число копеек в Decimal с двумя знаками."""
+    return Decimal(int(cents)).scaleb(-2)
 
 
 class User(UserMixin, db.Model):
@@ -52,9 +67,19 @@ class User(UserMixin, db.Model):
 
 
 class Transaction(db.Model):
+    __table_args__ = (
+        # Покрывает выборку транзакций пользователя по дате (keyset-пагинация)
+        sa.Index("ix_transaction_user_id_date_id", "user_id", "date", "id"),
+        # Строки живут в шарде владельца, если шардирование включено.
+        # AUTOINCREMENT не дает SQLite снова выдать id строк, перенесенных
+        # в архив: там они остаются с тем же id
+        {"info": {"sharded": True}, "sqlite_autoincrement": True},
+    )
+
     id: so.Mapped[int] = so.mapped_column(sa.Integer, primary_key=True)
-    amount: so.Mapped[Decimal] = so.mapped_column(
-        sa.Numeric(10, 2), nullable=False
+    # Сумма хранится в копейках, чтобы агрегаты считались по целым числам
+    amount_cents: so.Mapped[int] = so.mapped_column(
+        sa.BigInteger, nullable=False
     )
     type: so.Mapped[str] = so.mapped_column(sa.String(50), nullable=False)
     description: so.Mapped[str] = so.mapped_column(
@@ -64,7 +89,10 @@ class Transaction(db.Model):
         sa.DateTime, default=datetime.utcnow
     )
     image_filename: so.Mapped[Optional[str]] = so.mapped_column(
-        sa.String(200), nullable=True
+        sa.String(200), nullable=True, index=True
+    )
+    updated_at: so.Mapped[datetime] = so.mapped_column(
+        sa.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
     )
 
     user_id: so.Mapped[int] = so.mapped_column(
@@ -79,6 +107,76 @@ class Transaction(db.Model):
         back_populates="transactions"
     )
 
+    @hybrid_property
+    def amount(self) -> Decimal:
+        """Сумма транзакции в рублях."""
+        return from_minor_units(self.amount_cents)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_cents = to_minor_units(value)
+
+    @amount.expression
+    def amount(cls):
+        return cls.amount_cents / 100.0
+
+    is_archived = False
+
+
+class ArchivedTransaction(db.Model):
+    """Старая транзакция, перенесенная из горячей таблицы.
+
+    Строки только читаются и сохраняют id исходной транзакции, поэтому
+    их можно смешивать с горячими в одной выдаче.
+    """
+
+    __table_args__ = (
+        sa.Index(
+            "ix_archived_transaction_user_id_date_id", "user_id", "date", "id"
+        ),
+        {"info": {"sharded": True}},
+    )
+
+    id: so.Mapped[int] = so.mapped_column(
+        sa.Integer, primary_key=True, autoincrement=False
+    )
+    amount_cents: so.Mapped[int] = so.mapped_column(
+        sa.BigInteger, nullable=False
+    )
+    type: so.Mapped[str] = so.mapped_column(sa.String(50), nullable=False)
+    description: so.Mapped[str] = so.mapped_column(
+        sa.String(100), nullable=False
+    )
+    date: so.Mapped[datetime] = so.mapped_column(sa.DateTime)
+    image_filename: so.Mapped[Optional[str]] = so.mapped_column(
+        sa.String(200), nullable=True, index=True
+    )
+    updated_at: so.Mapped[Optional[datetime]] = so.mapped_column(
+        sa.DateTime, nullable=True
+    )
+    archived_at: so.Mapped[datetime] = so.mapped_column(
+        sa.DateTime, default=datetime.utcnow
+    )
+
+    user_id: so.Mapped[int] = so.mapped_column(
+        sa.Integer, sa.ForeignKey("user.id")
+    )
+    category_id: so.Mapped[int] = so.mapped_column(
+        sa.Integer, sa.ForeignKey("category.id")
+    )
+    category: so.Mapped["Category"] = so.relationship(viewonly=True)
+
+    @hybrid_property
+    def amount(self) -> Decimal:
+        """Сумма транзакции в рублях."""
+        return from_minor_units(self.amount_cents)
+
+    @amount.expression
+    def amount(cls):
+        return cls.amount_cents / 100.0
+
+    is_archived = True
+
 
 class Category(db.Model):
     id: so.Mapped[int] = so.mapped_column(sa.Integer, primary_key=True)
@@ -93,5 +191,38 @@ class Category(db.Model):
     @classmethod
     @cache_for(seconds=300)
     def get_all_cached(cls):
-        """Возвращает все категории с кешированием."""
-        return cls.query.all()
+        """Возвращает все категории с кешированием.
+
+        В кеше лежат строки (id, name), а не ORM-объекты: они не привязаны
+        к сессии и не устаревают после commit.
+        """
+        return db.session.execute(
+            sa.select(cls.id, cls.name).order_by(cls.id)
+        ).all()
+
+    @classmethod
+    def invalidate_cache(cls):
+        invalidate_cached(cls.get_all_cached, cls)
+
+
+class ReceiptFile(db.Model):
+    """Файл чека, общий для всех транзакций с одинаковым содержимым.
+
+    При шардировании ref_count (основная БД) и строки транзакций (шард)
+    коммитятся раздельно, поэтому счетчик приблизителен. Перед удалением
+    файла ссылки проверяются по шардам (delete_receipt), а файлы без
+    ссылок находит gc-receipts.
+    """
+
+    filename: so.Mapped[str] = so.mapped_column(
+        sa.String(200), primary_key=True
+    )
+    size: so.Mapped[Optional[int]] = so.mapped_column(
+        sa.Integer, nullable=True
+    )
+    ref_count: so.Mapped[int] = so.mapped_column(
+        sa.Integer, nullable=False, default=0
+    )
+    created_at: so.Mapped[datetime] = so.mapped_column(
+        sa.DateTime, default=datetime.utcnow
+    )
@@ -0,0 +1,96 @@
+import cProfile
+import hmac
+import logging
+import os
+import re
+import time
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "HTTP_X_PROFILE_TOKEN"
+PROFILE_PARAM = "_profile"
+
+
+class ProfilerMiddleware:
+    """Профилирует один запрос через cProfile по токену.
+
+    Запрос профилируется, если в заголовке X-Profile-Token или параметре
+    ?_profile= передан PROFILER_TOKEN. Результат сохраняется в .prof
+    (pstats), имя файла возвращается в заголовке X-Profile-File. Файл
+    открывается snakeviz, flameprof или `python -m pstats`.
+    """
+
+    def __init__(self, wsgi_app, token, profile_dir):
+        self.wsgi_app = wsgi_app
+        self.token = token.encode()
+        self.profile_dir = profile_dir
+
+    def is_requested(self, environ):
+        token = environ.get(PROFILE_HEADER)
+        if token is None:
+            query = environ.get("QUERY_STRING", "")
+            if PROFILE_PARAM not in query:
+                return False
+            token = parse_qs(query).get(PROFILE_PARAM, [""])[0]
+        return hmac.compare_digest(token.encode(), self.token)
+
+    def __call__(self, environ, start_response):
+        if not self.is_requested(environ):
+            return self.wsgi_app(environ, start_response)
+
+        name = self.profile_name(environ)
+
+        def profiled_start_response(status, headers, exc_info=None):
+            headers.append(("X-Profile-File", name))
+            return start_response(status, headers, exc_info)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        # Тело ответа читается внутри профиля, иначе потоковые ответы
+        # выполнялись бы уже после его остановки
+        profiler.enable()
+        try:
+            response = self.wsgi_app(environ, profiled_start_response)
+            try:
+                body = list(response)
+            finally:
+                if hasattr(response, "close"):
+                    response.close()
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, name))
+            logger.warning(
+                "Запрос профилирован: %s %s за %.1f мс, профиль %s",
+                environ.get("REQUEST_METHOD"),
+                environ.get("PATH_INFO"),
+                elapsed * 1000,
+                name,
+            )
+        return body
+
+    @staticmethod
+    def profile_name(environ):
+        """Имя файла профиля: время, метод и путь запроса."""
+        path = re.sub(r"[^A-Za-z0-9]+", "_", environ.get("PATH_INFO", ""))
+        return (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**6:06d}"
+            f"-{environ.get('REQUEST_METHOD', 'GET')}{path[:80]}.prof"
+        )
+
+
+def init_profiler(app):
+    """Подключает профилировщик, только если задан PROFILER_TOKEN.
+
+    Без токена middleware не устанавливается и запросы его не проходят.
+    """
+    token = app.config["PROFILER_TOKEN"]
+    if not token:
+        return
+    profile_dir = app.config["PROFILE_DIR"] or os.path.join(
+        app.instance_path, "profiles"
+    )
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, token, profile_dir)
+    logger.info(f"Профилирование по токену включено, профили в {profile_dir}")
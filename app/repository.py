@@ -0,0 +1,318 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from app.db import db, dialect_insert, sharding_enabled, shard_keys, use_shard
+from app.models import ArchivedTransaction, Category, Transaction
+from app.thumbnails import original_filename_candidates
+
+
+def load_category(model):
+    """Опция загрузки категории вместе с транзакциями.
+
+    Обычно это JOIN в том же запросе. При шардировании категории лежат
+    в основной БД, а транзакции в шарде, поэтому категории догружаются
+    отдельным запросом по списку id.
+    """
+    if sharding_enabled():
+        return so.selectinload(model.category)
+    return so.joinedload(model.category)
+
+
+def get_user_transaction(transaction_id, user_id, with_category=True,
+                         include_archive=False):
+    """Загружает транзакцию для пользователя одним запросом.
+
+    Поиск идет по первичному ключу, категория подгружается в том же
+    запросе через JOIN. С include_archive транзакция, которой нет
+    в горячей таблице, ищется в архиве (только для чтения). Возвращает
+    пару (транзакция, код ошибки): 404 - транзакции нет, 403 - она
+    принадлежит другому пользователю, None - транзакция доступна
+    пользователю.
+    """
+    models = [Transaction]
+    if include_archive:
+        models.append(ArchivedTransaction)
+
+    transaction = None
+    for model in models:
+        options = [load_category(model)] if with_category else []
+        transaction = db.session.get(model, transaction_id, options=options)
+        if transaction is not None:
+            break
+
+    if transaction is None:
+        return None, 404
+    if transaction.user_id != user_id:
+        return transaction, 403
+    return transaction, None
+
+
+def user_owns_receipt(user_id, filename):
+    """Проверяет, что файл чека (или его вариант) принадлежит пользователю.
+
+    Файл доступен, если на него ссылается хотя бы одна транзакция
+    пользователя; проверка - один EXISTS по транзакциям пользователя.
+    """
+    candidates = original_filename_candidates(filename)
+    return any(
+        db.session.scalar(
+            sa.select(
+                sa.exists().where(
+                    model.user_id == user_id,
+                    model.image_filename.in_(candidates),
+                )
+            )
+        )
+        for model in (Transaction, ArchivedTransaction)
+    )
+
+
+def encode_cursor(transaction):
+    """Курсор страницы: дата и id последней показанной транзакции."""
+    return f"{transaction.date.isoformat()}|{transaction.id}"
+
+
+def decode_cursor(cursor):
+    """Разбирает курсор страницы, при ошибке возвращает None."""
+    try:
+        date_str, id_str = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(date_str), int(id_str)
+    except (AttributeError, ValueError):
+        return None
+
+
+def paginate_transactions(query, cursor=None, per_page=50,
+                          model=Transaction):
+    """Keyset-пагинация транзакций от новых к старым.
+
+    Следующая страница выбирается по индексу (user_id, date, id) условием
+    "строго раньше курсора", поэтому стоимость запроса не зависит от номера
+    страницы. Возвращает пару (транзакции, курсор следующей страницы).
+    """
+    query = query.options(load_category(model)).order_by(
+        model.date.desc(), model.id.desc()
+    )
+
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        last_date, last_id = position
+        query = query.filter(
+            sa.or_(
+                model.date < last_date,
+                sa.and_(model.date == last_date, model.id < last_id),
+            )
+        )
+
+    transactions = query.limit(per_page + 1).all()
+    if len(transactions) > per_page:
+        transactions = transactions[:per_page]
+        return transactions, encode_cursor(transactions[-1])
+    return transactions, None
+
+
+def paginate_with_archive(query, archive_query, cursor=None, per_page=50):
+    """Keyset-пагинация по горячей таблице и архиву вместе.
+
+    Из каждой таблицы берется по странице после курсора, страницы
+    сливаются по (date, id). Архивные строки сохраняют свой id, а
+    горячая таблица не выдает id повторно (AUTOINCREMENT в SQLite,
+    последовательность в PostgreSQL), так что id не пересекаются
+    и порядок однозначен.
+    """
+    hot, hot_next = paginate_transactions(query, cursor, per_page)
+    cold, cold_next = paginate_transactions(
+        archive_query, cursor, per_page, model=ArchivedTransaction
+    )
+    merged = sorted(hot + cold, key=lambda t: (t.date, t.id), reverse=True)
+    if hot_next or cold_next or len(merged) > per_page:
+        merged = merged[:per_page]
+        return merged, encode_cursor(merged[-1])
+    return merged, None
+
+
+def latest_archived_date(user_id):
+    """Дата самой новой архивной транзакции пользователя или None."""
+    return db.session.scalar(
+        sa.select(sa.func.max(ArchivedTransaction.date)).where(
+            ArchivedTransaction.user_id == user_id
+        )
+    )
+
+
+def needs_archive(user_id, since=None):
+    """Нужно ли читать архив для выборки с датами от since.
+
+    Архив затрагивается, только если у пользователя есть архивные
+    транзакции не раньше since; без нижней границы - если они есть
+    вообще. Проверка - один запрос по индексу (user_id, date, id).
+    """
+    latest = latest_archived_date(user_id)
+    if latest is None:
+        return False
+    if since is None:
+        return True
+    if not isinstance(since, datetime):
+        since = datetime.combine(since, datetime.min.time())
+    return latest >= since
+
+
+def referenced_receipts(filenames):
+    """Имена из списка, на которые ссылается хотя бы одна транзакция.
+
+    Учитываются и архивные транзакции, при шардировании - во всех шардах.
+    """
+    # UNION обернут в подзапрос: голый UNION сессия не связывает
+    # с моделями и не может выбрать для него шард
+    union = sa.union(
+        *(
+            sa.select(model.image_filename.label("name")).where(
+                model.image_filename.in_(filenames)
+            )
+            for model in (Transaction, ArchivedTransaction)
+        )
+    ).subquery()
+    referenced = set()
+    for key in shard_keys():
+        with use_shard(key=key):
+            referenced.update(db.session.scalars(sa.select(union.c.name)))
+    return referenced
+
+
+def count_receipt_references(filenames):
+    """Число транзакций, ссылающихся на каждое имя, по всем шардам.
+
+    Учитываются и архивные транзакции; имен без ссылок в ответе нет.
+    """
+    union = sa.union_all(
+        *(
+            sa.select(model.image_filename.label("name")).where(
+                model.image_filename.in_(filenames)
+            )
+            for model in (Transaction, ArchivedTransaction)
+        )
+    ).subquery()
+    counts = {}
+    for key in shard_keys():
+        with use_shard(key=key):
+            rows = db.session.execute(
+                sa.select(union.c.name, sa.func.count()).group_by(
+                    union.c.name
+                )
+            )
+            for name, count in rows:
+                counts[name] = counts.get(name, 0) + count
+    return counts
+
+
+def iter_receipt_filenames(batch_size=500):
+    """Все имена файлов чеков из транзакций пачками, без повторов.
+
+    Пачки выбираются по индексу image_filename условием "больше
+    последнего имени", поэтому в памяти не больше одной пачки. При
+    шардировании шарды обходятся по очереди, и имя, на которое ссылаются
+    в нескольких шардах, встретится по разу в каждом.
+    """
+    for key in shard_keys():
+        last_name = None
+        while True:
+            selects = []
+            for model in (Transaction, ArchivedTransaction):
+                select = sa.select(model.image_filename.label("name")).where(
+                    model.image_filename.is_not(None)
+                )
+                if last_name is not None:
+                    select = select.where(model.image_filename > last_name)
+                selects.append(select)
+            union = sa.union(*selects).subquery()
+            with use_shard(key=key):
+                filenames = db.session.scalars(
+                    sa.select(union.c.name)
+                    .order_by(union.c.name)
+                    .limit(batch_size)
+                ).all()
+            if not filenames:
+                break
+            yield filenames
+            last_name = filenames[-1]
+
+
+def archive_transactions_batch(cutoff_date, batch_size=500):
+    """Переносит одну пачку транзакций старше cutoff_date в архив.
+
+    Строки копируются одним INSERT ... SELECT и удаляются из горячей
+    таблицы в текущей транзакции БД; ссылки на файлы чеков переходят
+    к архивным строкам. При шардировании работает с текущим шардом
+    (each_shard). Возвращает число перенесенных транзакций.
+    """
+    ids = db.session.scalars(
+        sa.select(Transaction.id)
+        .where(Transaction.date < cutoff_date)
+        .order_by(Transaction.id)
+        .limit(batch_size)
+    ).all()
+    if not ids:
+        return 0
+
+    columns = [
+        "id", "amount_cents", "type", "description", "date",
+        "image_filename", "updated_at", "user_id", "category_id",
+    ]
+    db.session.execute(
+        sa.insert(ArchivedTransaction).from_select(
+            columns,
+            sa.select(*(getattr(Transaction, name) for name in columns))
+            .where(Transaction.id.in_(ids)),
+        )
+    )
+    db.session.execute(
+        sa.delete(Transaction)
+        .where(Transaction.id.in_(ids))
+        .execution_options(synchronize_session=False)
+    )
+    return len(ids)
+
+
+def normalize_category_names(names):
+    """Имена категорий в том виде, в каком они хранятся, без повторов."""
+    normalized = (name.strip().capitalize() for name in names if name)
+    return list(dict.fromkeys(name for name in normalized if name))
+
+
+def add_categories(names, batch_size=500):
+    """Добавляет категории, которых еще нет, пачками.
+
+    На пачку - один запрос IN по существующим именам и один INSERT
+    ... ON CONFLICT DO NOTHING для новых, так что параллельное добавление
+    тех же имен не падает. Кеш категорий сбрасывается, только если
+    что-то добавилось. Возвращает пару (добавленные, уже существовавшие).
+    """
+    names = normalize_category_names(names)
+    added, existed = [], []
+
+    for start in range(0, len(names), batch_size):
+        chunk = names[start:start + batch_size]
+        found = set(
+            db.session.scalars(
+                sa.select(Category.name).where(Category.name.in_(chunk))
+            )
+        )
+        new_names = [name for name in chunk if name not in found]
+        inserted = set()
+        if new_names:
+            inserted = set(
+                db.session.scalars(
+                    dialect_insert(Category)
+                    .values([{"name": name} for name in new_names])
+                    .on_conflict_do_nothing(index_elements=["name"])
+                    .returning(Category.name)
+                )
+            )
+        added += [name for name in chunk if name in inserted]
+        existed += [name for name in chunk if name not in inserted]
+
+    db.session.commit()
+    if added:
+        Category.invalidate_cache()
+    return added, existed
@@ -0,0 +1,99 @@
+import io
+import math
+import random
+from datetime import timedelta
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:  # Pillow не установлен - чеки не генерируются
+    Image = None
+
+# Категория: тип, медианная сумма в рублях, разброс (сигма логнормального
+# распределения), описания и относительная частота операций
+CATEGORY_PROFILES = {
+    "Зарплата": ("income", 80000, 0.25, ["Зарплата", "Аванс"], 2),
+    "Подработка": ("income", 10000, 0.6, ["Фриланс", "Подработка"], 1),
+    "Еда": ("expense", 800, 0.8, ["Продукты", "Кафе", "Обед"], 30),
+    "Транспорт": ("expense", 300, 0.7, ["Метро", "Такси", "Бензин"], 20),
+    "Дом": ("expense", 3000, 0.9, ["Коммуналка", "Ремонт", "Химия"], 4),
+    "Развлечения": ("expense", 1500, 0.9, ["Кино", "Концерт", "Игры"], 5),
+    "Здоровье": ("expense", 2000, 1.0, ["Аптека", "Врач"], 3),
+    "Одежда": ("expense", 4000, 0.8, ["Одежда", "Обувь"], 2),
+}
+
+
+def seed_tasks(user_ids, per_user, chunk_size):
+    """Делит генерацию на задания примерно по chunk_size транзакций.
+
+    Задание - список пар (id пользователя, число транзакций), так что
+    и пользователь с большим числом транзакций делится на части.
+    """
+    tasks, task, size = [], [], 0
+    for user_id in user_ids:
+        remaining = per_user
+        while remaining:
+            count = min(remaining, chunk_size - size)
+            task.append((user_id, count))
+            size += count
+            remaining -= count
+            if size == chunk_size:
+                tasks.append(task)
+                task, size = [], 0
+    if task:
+        tasks.append(task)
+    return tasks
+
+
+def generate_transactions(task, seed, category_ids, image_names,
+                          image_ratio, now, days):
+    """Генерирует строки транзакций для одного задания.
+
+    Функция не обращается к БД и приложению, поэтому ее можно выполнять
+    в пуле процессов. Даты смещены к недавним, суммы распределены
+    логнормально вокруг медианы категории.
+    """
+    rng = random.Random(seed)
+    names = list(CATEGORY_PROFILES)
+    weights = [CATEGORY_PROFILES[name][4] for name in names]
+    rows = []
+
+    for user_id, count in task:
+        for name in rng.choices(names, weights=weights, k=count):
+            kind, median, sigma, descriptions, _ = CATEGORY_PROFILES[name]
+            amount = rng.lognormvariate(math.log(median), sigma)
+            date = now - timedelta(
+                days=int(days * rng.random() ** 1.5),
+                seconds=rng.randint(0, 24 * 3600 - 1),
+            )
+            image_filename = None
+            if image_names and kind == "expense" and (
+                rng.random() < image_ratio
+            ):
+                image_filename = rng.choice(image_names)
+            rows.append({
+                "amount_cents": max(1, round(amount * 100)),
+                "type": kind,
+                "description": rng.choice(descriptions),
+                "date": date,
+                "updated_at": date,
+                "image_filename": image_filename,
+                "user_id": user_id,
+                "category_id": category_ids[name],
+            })
+    return rows
+
+
+def generate_receipt_image(rng):
+    """PNG, похожий на чек: белая лента с "строками" разной длины."""
+    width = rng.randint(300, 500)
+    height = rng.randint(600, 1200)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(30, height - 30, 24):
+        line_width = rng.randint(width // 4, width - 40)
+        draw.rectangle((20, y, 20 + line_width, y + 8), fill=(60, 60, 60))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
@@ -0,0 +1,110 @@
+import logging
+import time
+from collections import Counter
+
+import sqlalchemy as sa
+from flask import g, has_request_context, request
+
+from app.db import db
+
+logger = logging.getLogger(__name__)
+
+
+class RequestSqlStats:
+    """Запросы к БД в рамках одного HTTP-запроса."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        """Запросы, выполненные не меньше threshold раз (похоже на N+1)."""
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if has_request_context():
+        context._sql_stats_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    started = getattr(context, "_sql_stats_started", None)
+    if started is None or not has_request_context():
+        return
+    if "sql_stats" not in g:
+        g.sql_stats = RequestSqlStats()
+    # Параметры в тексте - плейсхолдеры, так что одинаковый текст
+    # означает один и тот же запрос с разными значениями
+    g.sql_stats.add(statement, time.perf_counter() - started)
+
+
+def init_sql_stats(app):
+    """Считает запросы к БД на каждый HTTP-запрос.
+
+    Число запросов и время в БД пишутся в лог с уровнем
+    SQL_STATS_LOG_LEVEL и, если включен SQL_SERVER_TIMING, в заголовок
+    Server-Timing. Запрос, повторенный SQL_N_PLUS_ONE_THRESHOLD раз
+    и больше, логируется как N+1.
+    """
+    if not app.config["SQL_INSTRUMENTATION"]:
+        return
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        sa.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        sa.event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+    threshold = app.config["SQL_N_PLUS_ONE_THRESHOLD"]
+    log_level = logging.getLevelName(app.config["SQL_STATS_LOG_LEVEL"])
+    server_timing = app.config["SQL_SERVER_TIMING"]
+
+    @app.after_request
+    def report_sql_stats(response):
+        stats = g.pop("sql_stats", None)
+        if stats is None:
+            return response
+        duration_ms = stats.duration * 1000
+        if server_timing:
+            response.headers.add(
+                "Server-Timing",
+                f'db;dur={duration_ms:.1f};desc="{stats.count} queries"',
+            )
+
+        repeated = stats.repeated(threshold)
+        extra = {
+            "url": request.path,
+            "request_method": request.method,
+            "sql_queries": stats.count,
+            "sql_ms": round(duration_ms, 1),
+        }
+        if repeated:
+            logger.warning(
+                "Возможный N+1: %s запросов к БД, повторы: %s",
+                stats.count,
+                "; ".join(
+                    f"{count}x {' '.join(statement.split())[:200]}"
+                    for statement, count in repeated
+                ),
+                extra=extra,
+            )
+        else:
+            logger.log(
+                log_level,
+                "%s запросов к БД за %.1f мс",
+                stats.count,
+                duration_ms,
+                extra=extra,
+            )
+        return response
@@ -0,0 +1,726 @@
+import base64
+import itertools
+import logging
+import os
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+from flask import abort, current_app, redirect, send_file
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from app.db import db
+from app.metrics import record_upload
+from app.models import ReceiptFile
+from app.repository import (
+    count_receipt_references,
+    iter_receipt_filenames,
+    referenced_receipts,
+)
+from app.thumbnails import (
+    VARIANT_FORMATS,
+    delete_variants,
+    generate_variants,
+    get_executor,
+    original_filename_candidates,
+    pick_variant,
+    schedule_variants,
+    variant_filenames,
+)
+from app.uploads import (
+    acquire_receipt,
+    discard_stale_parts,
+    forget_receipts,
+    forget_unreferenced_receipt,
+    is_content_addressed,
+    receipt_path,
+    receipt_relpath,
+    restore_receipt,
+    shard_relpath,
+    stream_upload,
+)
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # boto3 не установлен - доступно только локальное
+    boto3 = None
+    ClientError = None
+
+logger = logging.getLogger(__name__)
+
+# MIME-типы оригиналов и вариантов по расширению
+CONTENT_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "gif": "image/gif",
+    **VARIANT_FORMATS,
+}
+EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/gif": "gif"}
+
+# Файл в хранилище: имя, размер в байтах и время изменения (unix)
+StoredFile = namedtuple("StoredFile", ["filename", "size", "modified"])
+
+
+def content_type_for(filename):
+    """MIME-тип файла чека по расширению."""
+    ext = filename.rsplit(".", 1)[-1].lower()
+    return CONTENT_TYPES.get(ext, "application/octet-stream")
+
+
+def apply_cache_headers(response, filename):
+    """Файлы с именем-хешем неизменяемы: сильный ETag и долгий кеш."""
+    response.cache_control.private = True
+    if is_content_addressed(filename):
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = (
+            current_app.config["RECEIPT_CACHE_MAX_AGE"]
+        )
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+class ReceiptStorage(ABC):
+    """Интерфейс хранилища файлов чеков.
+
+    Файлы адресуются именем-хешем содержимого; как и где они лежат,
+    знает только конкретное хранилище.
+    """
+
+    name = None
+    supports_direct_upload = False
+
+    @abstractmethod
+    def save(self, stream, max_size):
+        """Сохраняет поток и возвращает StoredUpload."""
+
+    @abstractmethod
+    def build_variants(self, filename, path=None):
+        """Ставит создание уменьшенных вариантов в фоновый пул."""
+
+    @abstractmethod
+    def exists(self, filename):
+        """Есть ли в хранилище файл с таким именем."""
+
+    @abstractmethod
+    def size_of(self, filename, fresh=False):
+        """Размер файла в байтах или None, если файла нет.
+
+        fresh=True требует проверить файл в обход кеша хранилища.
+        """
+
+    @abstractmethod
+    def delete(self, filename):
+        """Удаляет файл вместе с его вариантами."""
+
+    @abstractmethod
+    def iter_files(self):
+        """Потоково перечисляет все файлы хранилища как StoredFile."""
+
+    @abstractmethod
+    def discard(self, filenames):
+        """Удаляет файлы ровно с этими именами, без вариантов."""
+
+    @abstractmethod
+    def discard_stale_uploads(self, min_age, dry_run=False):
+        """Удаляет брошенные временные файлы загрузок старше min_age.
+
+        Возвращает их список StoredFile; при dry_run только находит.
+        """
+
+    @abstractmethod
+    def send(self, filename):
+        """Ответ, отдающий файл клиенту."""
+
+    def presign_upload(self, upload_id, filename, size, sha256,
+                       content_type):
+        """Параметры прямой загрузки файла клиентом в обход приложения.
+
+        Файл загружается во временное место загрузки upload_id и
+        переносится в хранилище claim_upload. Нужен только хранилищам
+        с supports_direct_upload.
+        """
+        raise NotImplementedError
+
+    def claim_upload(self, upload_id, filename):
+        """Переносит загрузку upload_id в хранилище под именем filename.
+
+        Возвращает размер файла или None, если загрузки нет.
+        """
+        raise NotImplementedError
+
+
+class LocalReceiptStorage(ReceiptStorage):
+    """Файлы чеков в папке UPLOAD_FOLDER в раскладке ab/cd/<имя>."""
+
+    name = "local"
+
+    def __init__(self, root, config):
+        self.root = root
+        self.config = config
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, filename):
+        return receipt_path(self.root, filename)
+
+    def save(self, stream, max_size):
+        return stream_upload(stream, self.root, max_size)
+
+    def build_variants(self, filename, path=None):
+        return schedule_variants(path or self.path(filename), self.config)
+
+    def exists(self, filename):
+        return os.path.isfile(self.path(filename))
+
+    def size_of(self, filename, fresh=False):
+        try:
+            return os.path.getsize(self.path(filename))
+        except OSError:
+            return None
+
+    def delete(self, filename):
+        filepath = self.path(filename)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+            logger.info(f"Файл удален: {filepath}")
+        delete_variants(filepath, self.config["RECEIPT_VARIANT_SIZES"])
+
+    def iter_files(self, folder=None):
+        # Скрытые файлы - недописанные загрузки и варианты
+        with os.scandir(folder or self.root) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    yield from self.iter_files(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    yield StoredFile(entry.name, stat.st_size, stat.st_mtime)
+
+    def discard(self, filenames):
+        for filename in filenames:
+            filepath = self.path(filename)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    def discard_stale_uploads(self, min_age, dry_run=False):
+        return [
+            StoredFile(*part)
+            for part in discard_stale_parts(self.root, min_age, dry_run)
+        ]
+
+    def send(self, filename):
+        """Отдает файл чека клиенту.
+
+        Если настроен RECEIPTS_ACCEL_REDIRECT_PREFIX, ответ содержит только
+        заголовок X-Accel-Redirect и файл отдает nginx; при USE_X_SENDFILE
+        это делает фронтовой сервер через X-Sendfile. Иначе файл отдается
+        через send_file с поддержкой Range и условных запросов.
+        """
+        relpath = receipt_relpath(self.root, filename)
+        path = os.path.join(self.root, relpath)
+        if not os.path.isfile(path):
+            abort(404)
+
+        accel_prefix = self.config["RECEIPTS_ACCEL_REDIRECT_PREFIX"]
+        if accel_prefix:
+            response = current_app.response_class()
+            response.headers["X-Accel-Redirect"] = (
+                accel_prefix.rstrip("/") + "/" + relpath.replace(os.sep, "/")
+            )
+            # Тип определит nginx по расширению файла
+            del response.headers["Content-Type"]
+        else:
+            response = send_file(
+                path,
+                conditional=True,
+                etag=filename if is_content_addressed(filename) else True,
+                max_age=None,
+            )
+        return apply_cache_headers(response, filename)
+
+
+class S3ReceiptStorage(ReceiptStorage):
+    """Файлы чеков в S3-совместимом хранилище (AWS S3, MinIO и т.п.).
+
+    Отдача идет редиректом на подписанную ссылку, загрузка - либо через
+    приложение, либо напрямую клиентом по подписанному PUT. Загрузка через
+    приложение сначала пишется во временную папку: так проверяются
+    сигнатура и размер и считается хеш до отправки в бакет.
+    """
+
+    name = "s3"
+    supports_direct_upload = True
+
+    # Сколько секунд помнить, что варианта еще нет: он появится позже
+    MISSING_TTL = 60
+
+    def __init__(self, config, client=None):
+        self.config = config
+        self.bucket = config["S3_BUCKET"]
+        self.prefix = config["S3_PREFIX"]
+        self.incoming_prefix = config["S3_INCOMING_PREFIX"]
+        self.expires = config["S3_PRESIGN_EXPIRES"]
+        self.spool = config["S3_SPOOL_FOLDER"]
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("Для хранилища S3 нужен пакет boto3")
+            client = boto3.client(
+                "s3",
+                endpoint_url=config["S3_ENDPOINT_URL"],
+                region_name=config["S3_REGION"],
+            )
+        self.client = client
+        self._sizes = {}
+        self._sizes_lock = threading.Lock()
+
+    def key(self, filename):
+        return self.prefix + shard_relpath(filename).replace(os.sep, "/")
+
+    def incoming_key(self, upload_id, filename):
+        return f"{self.incoming_prefix}{upload_id}/{filename}"
+
+    def save(self, stream, max_size):
+        stored = stream_upload(stream, self.spool, max_size)
+        created = not self.touch(stored.filename)
+        try:
+            if created:
+                self.client.upload_file(
+                    stored.path,
+                    self.bucket,
+                    self.key(stored.filename),
+                    ExtraArgs={
+                        "ContentType": content_type_for(stored.filename),
+                        "ChecksumAlgorithm": "SHA256",
+                    },
+                )
+                self._remember_size(stored.filename, stored.size)
+        except Exception:
+            os.remove(stored.path)
+            raise
+        # Копию в папке-спуле другого запроса с тем же файлом не трогаем
+        if not created and stored.created:
+            os.remove(stored.path)
+        return stored._replace(created=created)
+
+    def touch(self, filename):
+        """Обновляет LastModified объекта; False, если его нет.
+
+        Как и для локальных файлов, это защищает от gc-receipts файл,
+        на который снова ссылаются. S3 не меняет дату объекта без
+        записи, поэтому объект копируется сам в себя.
+        """
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket,
+                Key=self.key(filename),
+                CopySource={"Bucket": self.bucket, "Key": self.key(filename)},
+                ContentType=content_type_for(filename),
+                MetadataDirective="REPLACE",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            return False
+        return True
+
+    def build_variants(self, filename, path=None):
+        executor = get_executor(self.config["RECEIPT_VARIANT_WORKERS"])
+        return executor.submit(self._build_variants_safely, filename, path)
+
+    def _build_variants_safely(self, filename, path):
+        """Создает варианты из локальной копии и выгружает их в бакет.
+
+        Если локальной копии нет (прямая загрузка), оригинал скачивается.
+        Временные файлы удаляются в любом случае.
+        """
+        if path is None:
+            path = os.path.join(self.spool, shard_relpath(filename))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        created = []
+        try:
+            if not os.path.exists(path):
+                self.client.download_file(
+                    self.bucket, self.key(filename), path
+                )
+            created = generate_variants(
+                path,
+                self.config["RECEIPT_VARIANT_SIZES"],
+                self.config["RECEIPT_VARIANT_QUALITY"],
+                self.config["RECEIPT_MAX_PIXELS"],
+                keep=lambda: self.size_of(filename, fresh=True) is not None,
+            )
+            for variant_path in created:
+                name = os.path.basename(variant_path)
+                self.client.upload_file(
+                    variant_path,
+                    self.bucket,
+                    self.key(name),
+                    ExtraArgs={"ContentType": content_type_for(name)},
+                )
+                self._remember_size(name, os.path.getsize(variant_path))
+            # Чек удалили, пока варианты выгружались: убираем их
+            if created and self.size_of(filename, fresh=True) is None:
+                self.delete(filename)
+        except Exception as e:
+            logger.error(f"Ошибка создания вариантов {filename}: {str(e)}")
+        finally:
+            for tmp_path in [path, *created]:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _remember_size(self, filename, size):
+        with self._sizes_lock:
+            self._sizes[filename] = (size, None)
+
+    def size_of(self, filename, fresh=False):
+        """Размер объекта по HEAD-запросу.
+
+        Объекты неизменяемы, поэтому размер кешируется навсегда, а
+        отсутствие - на MISSING_TTL секунд, чтобы страница со списком
+        не делала HEAD на каждый еще не созданный вариант.
+        """
+        now = time.monotonic()
+        with self._sizes_lock:
+            cached = self._sizes.get(filename)
+        if cached is not None and not fresh:
+            size, checked_at = cached
+            if size is not None or now - checked_at < self.MISSING_TTL:
+                return size
+
+        try:
+            head = self.client.head_object(
+                Bucket=self.bucket, Key=self.key(filename)
+            )
+            size, checked_at = head["ContentLength"], None
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            size, checked_at = None, now
+
+        with self._sizes_lock:
+            self._sizes[filename] = (size, checked_at)
+        return size
+
+    def exists(self, filename):
+        return self.size_of(filename) is not None
+
+    def delete(self, filename):
+        names = [filename] + variant_filenames(
+            filename, self.config["RECEIPT_VARIANT_SIZES"]
+        )
+        self.client.delete_objects(
+            Bucket=self.bucket,
+            Delete={
+                "Objects": [{"Key": self.key(name)} for name in names],
+                "Quiet": True,
+            },
+        )
+        with self._sizes_lock:
+            for name in names:
+                self._sizes.pop(name, None)
+        logger.info(f"Файл удален из бакета: {filename}")
+
+    def iter_files(self):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                yield StoredFile(
+                    item["Key"].rsplit("/", 1)[-1],
+                    item["Size"],
+                    item["LastModified"].timestamp(),
+                )
+
+    def discard(self, filenames):
+        filenames = list(filenames)
+        # delete_objects принимает не больше 1000 ключей за запрос
+        for start in range(0, len(filenames), 1000):
+            chunk = filenames[start:start + 1000]
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [{"Key": self.key(name)} for name in chunk],
+                    "Quiet": True,
+                },
+            )
+        with self._sizes_lock:
+            for name in filenames:
+                self._sizes.pop(name, None)
+
+    def discard_stale_uploads(self, min_age, dry_run=False):
+        # Загрузки через приложение пишутся в спул; незабранные прямые
+        # загрузки удаляет правило жизненного цикла бакета
+        return [
+            StoredFile(*part)
+            for part in discard_stale_parts(self.spool, min_age, dry_run)
+        ]
+
+    def send(self, filename):
+        """Редирект на подписанную ссылку для скачивания из бакета.
+
+        Сам редирект кешируется клиентом на половину срока жизни ссылки.
+        """
+        url = self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.key(filename),
+                "ResponseCacheControl": (
+                    f"private, max-age="
+                    f"{self.config['RECEIPT_CACHE_MAX_AGE']}, immutable"
+                ),
+            },
+            ExpiresIn=self.expires,
+        )
+        response = redirect(url, 302)
+        response.cache_control.private = True
+        response.cache_control.max_age = self.expires // 2
+        return response
+
+    def presign_upload(self, upload_id, filename, size, sha256,
+                       content_type):
+        """Подписанный PUT с фиксированными размером, типом и SHA-256.
+
+        Бакет сам отклонит файл, содержимое которого не совпадает с
+        заявленным хешем, поэтому имя-хеш остается честным. Загрузка
+        идет в S3_INCOMING_PREFIX, а не сразу под итоговым ключом.
+        """
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.incoming_key(upload_id, filename),
+                "ContentType": content_type,
+                "ContentLength": size,
+                "ChecksumSHA256": checksum,
+            },
+            ExpiresIn=self.expires,
+        )
+        return {
+            "method": "PUT",
+            "url": url,
+            "headers": {
+                "Content-Type": content_type,
+                "x-amz-checksum-sha256": checksum,
+            },
+            "expires_in": self.expires,
+        }
+
+    def claim_upload(self, upload_id, filename):
+        """Копирует загрузку под итоговый ключ и удаляет временный объект.
+
+        Если файл с таким содержимым уже есть, копия не нужна: загрузка
+        лишь доказывает, что у клиента есть этот файл.
+        """
+        source = self.incoming_key(upload_id, filename)
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=source)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            return None
+        size = head["ContentLength"]
+        if not self.touch(filename):
+            self.client.copy_object(
+                Bucket=self.bucket,
+                Key=self.key(filename),
+                CopySource={"Bucket": self.bucket, "Key": source},
+                ContentType=content_type_for(filename),
+                MetadataDirective="REPLACE",
+            )
+            self._remember_size(filename, size)
+        self.client.delete_object(Bucket=self.bucket, Key=source)
+        return size
+
+
+def create_storage(config):
+    """Создает хранилище чеков по настройке RECEIPT_STORAGE."""
+    backend = config["RECEIPT_STORAGE"]
+    if backend == "local":
+        return LocalReceiptStorage(config["UPLOAD_FOLDER"], config)
+    if backend == "s3":
+        return S3ReceiptStorage(config)
+    raise ValueError(f"Неизвестное хранилище чеков: {backend}")
+
+
+def init_storage(app):
+    app.extensions["receipt_storage"] = create_storage(app.config)
+    return app.extensions["receipt_storage"]
+
+
+def get_storage():
+    return current_app.extensions["receipt_storage"]
+
+
+def save_receipt(file):
+    """Сохраняет загруженное изображение чека и возвращает имя файла.
+
+    Ссылка на файл добавляется в текущую транзакцию БД. При ошибке
+    возвращает None.
+    """
+    if not file or not file.filename or "." not in file.filename:
+        return None
+    ext = file.filename.rsplit(".", 1)[1].lower()
+    if ext not in current_app.config["ALLOWED_EXTENSIONS"]:
+        return None
+
+    storage = get_storage()
+    try:
+        stored = storage.save(
+            file.stream, max_size=current_app.config["MAX_CONTENT_LENGTH"]
+        )
+        logger.info(f"Файл сохранен: {stored.filename} ({stored.size} байт)")
+        record_upload(storage.name, "app", stored.size, stored.created)
+        if stored.created:
+            storage.build_variants(stored.filename, stored.path)
+        acquire_receipt(stored.filename, stored.size)
+        return stored.filename
+    except Exception as e:
+        logger.error(f"Ошибка сохранения файла: {str(e)}")
+        return None
+
+
+def upload_token_serializer():
+    return URLSafeTimedSerializer(
+        current_app.config["SECRET_KEY"], salt="receipt-upload"
+    )
+
+
+def presign_receipt_upload(user_id, sha256, size, content_type):
+    """Готовит прямую загрузку чека клиентом в хранилище.
+
+    Возвращает имя будущего файла, параметры запроса и receipt_token,
+    который после загрузки передается в транзакцию. Загружать нужно
+    и уже известный файл: иначе любой, кто знает хеш, получил бы
+    доступ к чужому чеку.
+    """
+    storage = get_storage()
+    filename = f"{sha256}.{EXTENSIONS[content_type]}"
+    upload_id = secrets.token_urlsafe(16)
+    token = upload_token_serializer().dumps(
+        {"user_id": user_id, "filename": filename, "upload_id": upload_id}
+    )
+    return {
+        "filename": filename,
+        "receipt_token": token,
+        "upload": storage.presign_upload(
+            upload_id, filename, size, sha256, content_type
+        ),
+    }
+
+
+def attach_uploaded_receipt(token, user_id):
+    """Берет ссылку на чек, загруженный пользователем напрямую.
+
+    token - receipt_token из presign_receipt_upload, выданный этому же
+    пользователю; загрузка по нему забирается один раз. Возвращает имя
+    файла или None, если токен не подходит или файл не загружен.
+    """
+    storage = get_storage()
+    if not token or not storage.supports_direct_upload:
+        return None
+    try:
+        claim = upload_token_serializer().loads(
+            token, max_age=current_app.config["RECEIPT_UPLOAD_TOKEN_MAX_AGE"]
+        )
+    except BadSignature:
+        return None
+    filename = claim.get("filename")
+    if claim.get("user_id") != user_id or not is_content_addressed(filename):
+        return None
+    size = storage.claim_upload(claim["upload_id"], filename)
+    if size is None:
+        return None
+    # Для уже известного файла варианты создавались при первой ссылке
+    created = db.session.get(ReceiptFile, filename) is None
+    if created:
+        storage.build_variants(filename)
+    record_upload(storage.name, "direct", size, created)
+    acquire_receipt(filename, size)
+    return filename
+
+
+def delete_receipt(filename):
+    """Удаляет файл чека, если на него не осталось ссылок.
+
+    Счетчику ссылок верить до конца нельзя (см. ReceiptFile), поэтому
+    перед удалением ссылки пересчитываются по транзакциям всех шардов;
+    если они нашлись, счетчик исправляется, а файл остается.
+    """
+    if not filename or not forget_unreferenced_receipt(filename):
+        return
+    ref_count = count_receipt_references([filename]).get(filename)
+    if ref_count:
+        logger.warning(
+            f"Счетчик ссылок {filename} разошелся с транзакциями, "
+            f"исправлен на {ref_count}"
+        )
+        restore_receipt(filename, ref_count, get_storage().size_of(filename))
+        db.session.commit()
+        return
+    try:
+        get_storage().delete(filename)
+    except Exception as e:
+        logger.error(f"Ошибка удаления файла {filename}: {str(e)}")
+
+
+def send_receipt(filename):
+    return get_storage().send(filename)
+
+
+def receipt_variant(filename, size_name, accepted_types):
+    """Самый легкий готовый вариант чека, который примет клиент."""
+    return pick_variant(
+        filename, size_name, accepted_types, get_storage().size_of
+    )
+
+
+def find_orphan_receipts(storage, batch_size=500, min_age=3600):
+    """Пачки файлов, на которые не ссылается ни одна транзакция.
+
+    Список файлов читается потоком, для каждой пачки ссылки проверяются
+    одним запросом, так что в памяти не больше одной пачки. Файлы моложе
+    min_age секунд пропускаются: их транзакция может еще не сохраниться.
+    """
+    cutoff = time.time() - min_age
+    files = storage.iter_files()
+    while True:
+        batch = list(itertools.islice(files, batch_size))
+        if not batch:
+            return
+        candidates = {
+            stored.filename: original_filename_candidates(stored.filename)
+            for stored in batch
+        }
+        referenced = referenced_receipts(
+            {name for names in candidates.values() for name in names}
+        )
+        orphans = [
+            stored
+            for stored in batch
+            if stored.modified < cutoff
+            and referenced.isdisjoint(candidates[stored.filename])
+        ]
+        if orphans:
+            yield orphans
+
+
+def discard_orphan_receipts(storage, orphans):
+    """Удаляет файлы-сироты и их записи в счетчике ссылок."""
+    filenames = [stored.filename for stored in orphans]
+    storage.discard(filenames)
+    forget_receipts(filenames)
+
+
+def find_missing_receipts(storage, batch_size=500):
+    """Пачки имен из транзакций, файлов для которых нет в хранилище."""
+    for filenames in iter_receipt_filenames(batch_size):
+        missing = [name for name in filenames if not storage.exists(name)]
+        if missing:
+            yield missing
@@ -0,0 +1,186 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен - варианты не создаются
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Форматы вариантов в порядке предпочтения и их MIME-типы
+VARIANT_FORMATS = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+}
+# Формат, который понимает любой клиент, даже без него в Accept
+FALLBACK_FORMAT = "jpeg"
+
+# Расширения оригиналов, для которых создаются варианты
+ORIGINAL_EXTENSIONS = ("png", "jpg", "jpeg", "gif")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_filename(filename, size_name, fmt):
+    """Имя файла варианта: <имя>.<размер>.<формат>."""
+    stem = filename.rsplit(".", 1)[0]
+    return f"{stem}.{size_name}.{fmt}"
+
+
+def variant_filenames(filename, sizes):
+    """Все возможные имена вариантов для изображения."""
+    return [
+        variant_filename(filename, size_name, fmt)
+        for size_name in sizes
+        for fmt in VARIANT_FORMATS
+    ]
+
+
+def original_filename_candidates(filename):
+    """Имена оригинала, к которому может относиться файл или его вариант."""
+    stem = filename.split(".", 1)[0]
+    return [filename] + [f"{stem}.{ext}" for ext in ORIGINAL_EXTENSIONS]
+
+
+def supported_formats():
+    """Форматы вариантов, которые умеет сохранять установленный Pillow."""
+    if Image is None:
+        return []
+    Image.init()
+    return [fmt for fmt in VARIANT_FORMATS if fmt.upper() in Image.SAVE]
+
+
+def without_alpha(image):
+    """Копия изображения на белом фоне - для форматов без прозрачности."""
+    if image.mode == "RGB":
+        return image
+    background = Image.new("RGB", image.size, "white")
+    background.paste(image, mask=image.getchannel("A"))
+    return background
+
+
+def generate_variants(path, sizes, quality=80, max_pixels=None, keep=None):
+    """Создает уменьшенные варианты изображения рядом с оригиналом.
+
+    Каждый вариант пишется во временный файл и атомарно переименовывается,
+    так что наполовину записанный вариант никогда не отдается клиенту.
+    Изображение больше max_pixels пикселей не декодируется. keep()
+    проверяется вокруг записи каждого варианта (по умолчанию - есть ли
+    еще оригинал): если чек удалили, варианты не остаются сиротами.
+    """
+    folder, filename = os.path.split(path)
+    formats = supported_formats()
+    if keep is None:
+        def keep():
+            return os.path.exists(path)
+    created = []
+
+    with Image.open(path) as original:
+        # Размер известен из заголовка, до распаковки пикселей
+        width, height = original.size
+        if max_pixels and width * height > max_pixels:
+            raise ValueError(
+                f"Слишком большое изображение: {width}x{height}"
+            )
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+
+        for size_name, max_side in sizes.items():
+            resized = image.copy()
+            resized.thumbnail((max_side, max_side))
+            for fmt in formats:
+                if not keep():
+                    return remove_variants(created, filename)
+                target = os.path.join(
+                    folder, variant_filename(filename, size_name, fmt)
+                )
+                tmp_path = f"{target}.part"
+                output = resized if fmt != "jpeg" else without_alpha(resized)
+                output.save(tmp_path, format=fmt.upper(), quality=quality)
+                os.replace(tmp_path, target)
+                created.append(target)
+
+    # Чек могли удалить, пока писался последний вариант
+    if not keep():
+        return remove_variants(created, filename)
+    logger.info(f"Созданы варианты изображения {filename}")
+    return created
+
+
+def remove_variants(paths, filename):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    logger.info(f"Чек {filename} удален, варианты не создаются")
+    return []
+
+
+def _generate_variants_safely(path, sizes, quality, max_pixels):
+    try:
+        generate_variants(path, sizes, quality, max_pixels)
+    except Exception as e:
+        logger.error(f"Ошибка создания вариантов {path}: {str(e)}")
+
+
+def get_executor(max_workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="thumbnails"
+            )
+        return _executor
+
+
+def schedule_variants(path, config):
+    """Ставит создание вариантов изображения в фоновый пул.
+
+    Загрузка не ждет обработку: пока варианты не готовы,
+    отдается оригинал.
+    """
+    if Image is None:
+        return None
+    executor = get_executor(config["RECEIPT_VARIANT_WORKERS"])
+    return executor.submit(
+        _generate_variants_safely,
+        path,
+        config["RECEIPT_VARIANT_SIZES"],
+        config["RECEIPT_VARIANT_QUALITY"],
+        config["RECEIPT_MAX_PIXELS"],
+    )
+
+
+def delete_variants(path, sizes):
+    """Удаляет все варианты изображения, если они есть."""
+    folder, filename = os.path.split(path)
+    for name in variant_filenames(filename, sizes):
+        variant_path = os.path.join(folder, name)
+        if os.path.exists(variant_path):
+            os.remove(variant_path)
+
+
+def pick_variant(filename, size_name, accepted_types, size_of):
+    """Выбирает самый легкий доступный вариант, который примет клиент.
+
+    size_of возвращает размер файла по имени или None, если файла нет.
+    Возвращает имя файла варианта или исходное имя, если подходящих
+    вариантов еще нет. FALLBACK_FORMAT подходит любому клиенту.
+    """
+    best_name = filename
+    best_size = size_of(filename)
+    for fmt, mime_type in VARIANT_FORMATS.items():
+        if mime_type not in accepted_types and fmt != FALLBACK_FORMAT:
+            continue
+        name = variant_filename(filename, size_name, fmt)
+        size = size_of(name)
+        if size is None:
+            continue
+        if best_size is None or size < best_size:
+            best_name, best_size = name, size
+    return best_name
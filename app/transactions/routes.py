@@ -1,9 +1,10 @@
 import logging
-import os
-import uuid
-from decimal import Decimal
+from collections import Counter
 
+import sqlalchemy as sa
 from flask import (
+    abort,
+    current_app,
     url_for,
     redirect,
     render_template,
@@ -14,66 +15,31 @@ from flask_login import current_user, login_required
 
 from . import transactions_bp
 from app import db
-from app.models import Transaction
+from app.models import ArchivedTransaction, Transaction, from_minor_units
+from app.repository import (
+    get_user_transaction,
+    needs_archive,
+    paginate_transactions,
+    paginate_with_archive,
+    user_owns_receipt,
+)
+from app.storage import delete_receipt, save_receipt, send_receipt
+from app.uploads import release_receipt
 from app.forms import TransactionForm, DeleteConfirmForm, FilterForm
 
 logger = logging.getLogger(__name__)
 
 
-def save_receipt_image(file):
-    """Сохраняет изображение чека и возвращает имя файла."""
-    if not file or file.filename == "":
-        return None
-
-    if "." in file.filename:
-        ext = file.filename.rsplit(".", 1)[1].lower()
-        if ext not in ["jpg", "jpeg", "png", "gif"]:
-            return None
-    else:
-        return None
-
-    filename = f"{uuid.uuid4()}.{ext}"
-
-    # Создаем папки от корня проекта
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    upload_folder = os.path.join(base_dir, "static", "uploads", "transactions")
-
-    # Гарантируем что папки существуют
-    os.makedirs(upload_folder, exist_ok=True)
-
-    filepath = os.path.join(upload_folder, filename)
+def apply_transaction_filters(query, form, model=None):
+    """Применяет фильтры формы к запросу транзакций модели model.
 
-    try:
-        file.save(filepath)
-        logger.info(f"Файл сохранен: {filepath}")
-        return filename
-    except Exception as e:
-        logger.error(f"Ошибка сохранения файла: {str(e)}")
-        return None
-
-
-def delete_receipt_image(filename):
-    """Удаляет изображение чека."""
-    if not filename:
-        return
-
-    import os
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    filepath = os.path.join(
-        base_dir, "static", "uploads", "transactions", filename)
-
-    try:
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            logger.info(f"Файл удален: {filepath}")
-    except Exception as e:
-        logger.error(f"Ошибка удаления файла {filename}: {str(e)}")
-
-
-def apply_transaction_filters(query, form):
+    Возвращает запрос, описание фильтра и начало периода (None - без
+    нижней границы по дате).
+    """
     from datetime import date, timedelta
     from app.models import Category, Transaction
 
+    model = model or Transaction
     period = form.period.data
     category_id = form.category_id.data
     transaction_type = form.transaction_type.data
@@ -82,48 +48,37 @@ def apply_transaction_filters(query, form):
 
     today = date.today()
     tomorrow = today + timedelta(days=1)
+    since = None
 
     if period == "today":
-        query = query.filter(
-            Transaction.date >= today, Transaction.date < tomorrow
-        )
+        since = today
         description_parts.append("сегодня")
 
     elif period == "this_week":
         days_since_monday = today.weekday()
-        monday = today - timedelta(days=days_since_monday)
-        query = query.filter(
-            Transaction.date >= monday, Transaction.date < tomorrow
-        )
+        since = today - timedelta(days=days_since_monday)
         description_parts.append("за эту неделю")
 
     elif period == "this_month":
-        first_of_the_month = date(today.year, today.month, 1)
-        query = query.filter(
-            Transaction.date >= first_of_the_month,
-            Transaction.date < tomorrow,
-        )
+        since = date(today.year, today.month, 1)
         description_parts.append("за этот месяц")
 
     elif period == "last_3_months":
-        three_month_ago = today - timedelta(days=90)
-        query = query.filter(
-            Transaction.date >= three_month_ago, Transaction.date < tomorrow
-        )
+        since = today - timedelta(days=90)
         description_parts.append("за последние 3 месяца")
 
     elif period == "this_year":
-        first_of_the_year = date(today.year, 1, 1)
-        query = query.filter(
-            Transaction.date >= first_of_the_year, Transaction.date < tomorrow
-        )
+        since = date(today.year, 1, 1)
         description_parts.append("за этот год")
 
     elif period == "all_time":
         description_parts.append("за все время")
 
+    if since is not None:
+        query = query.filter(model.date >= since, model.date < tomorrow)
+
     if category_id:
-        query = query.filter(Transaction.category_id == category_id)
+        query = query.filter(model.category_id == category_id)
         category = Category.query.get(category_id)
         if category:
             description_parts.append(f"{category.name}")
@@ -132,11 +87,11 @@ def apply_transaction_filters(query, form):
         description_parts.append("Все")
 
     elif transaction_type == "income":
-        query = query.filter(Transaction.type == "income")
+        query = query.filter(model.type == "income")
         description_parts.append("Доходы")
 
     elif transaction_type == "expense":
-        query = query.filter(Transaction.type == "expense")
+        query = query.filter(model.type == "expense")
         description_parts.append("Расходы")
 
     if not description_parts:
@@ -144,7 +99,16 @@ def apply_transaction_filters(query, form):
     else:
         description = " • ".join(description_parts)
 
-    return query, description
+    return query, description, since
+
+
+def sum_by_type(query, model):
+    """Суммы в копейках по типам транзакций одним запросом."""
+    return dict(
+        query.with_entities(model.type, sa.func.sum(model.amount_cents))
+        .group_by(model.type)
+        .all()
+    )
 
 
 @transactions_bp.route("/")
@@ -153,27 +117,56 @@ def transaction_main():
     logger.info("Показ транзакций пользователя %s", current_user.id)
     form = FilterForm(request.args)
     query = Transaction.query.filter_by(user_id=current_user.id)
+    archive_query = ArchivedTransaction.query.filter_by(
+        user_id=current_user.id
+    )
     filter_description = ""
+    since = None
 
     if form.validate():
-        query, filter_description = apply_transaction_filters(query, form)
+        query, filter_description, since = apply_transaction_filters(
+            query, form
+        )
+        archive_query, _, _ = apply_transaction_filters(
+            archive_query, form, ArchivedTransaction
+        )
     else:
         filter_description = ""
 
-    all_transactions = query.all()
+    # Архив читается, только если выбранный период до него дотягивается
+    if not needs_archive(current_user.id, since):
+        archive_query = None
 
-    total_income = Decimal(
-        str(sum(t.amount for t in all_transactions if t.type == "income"))
-    )
-    total_expense = Decimal(
-        str(sum(t.amount for t in all_transactions if t.type == "expense"))
-    )
+    cursor = request.args.get("cursor")
+    per_page = current_app.config["TRANSACTIONS_PER_PAGE"]
+    if archive_query is None:
+        transactions, next_cursor = paginate_transactions(
+            query, cursor=cursor, per_page=per_page
+        )
+    else:
+        transactions, next_cursor = paginate_with_archive(
+            query, archive_query, cursor=cursor, per_page=per_page
+        )
+    next_url = None
+    if next_cursor:
+        next_url = url_for(
+            "transactions.transaction_main",
+            **{**request.args.to_dict(), "cursor": next_cursor},
+        )
+
+    # Итоги считаются в БД по целым копейкам одним запросом
+    totals = Counter(sum_by_type(query, Transaction))
+    if archive_query is not None:
+        totals.update(sum_by_type(archive_query, ArchivedTransaction))
+    total_income = from_minor_units(totals.get("income") or 0)
+    total_expense = from_minor_units(totals.get("expense") or 0)
     balance = total_income - total_expense
 
     return render_template(
         "transactions/all_transactions.html",
         title="Все транзакции",
-        transactions=all_transactions,
+        transactions=transactions,
+        next_url=next_url,
         total_income=total_income,
         total_expense=total_expense,
         balance=balance,
@@ -195,7 +188,7 @@ def add_transaction():
 
         image_filename = None
         if form.receipt_image.data:
-            image_filename = save_receipt_image(form.receipt_image.data)
+            image_filename = save_receipt(form.receipt_image.data)
             if image_filename is None:
                 flash("Ошибка при сохранении изображения", "error")
                 return render_template("transactions/add.html", form=form)
@@ -228,7 +221,7 @@ def add_transaction():
         except Exception:
             db.session.rollback()
             if image_filename:
-                delete_receipt_image(image_filename)
+                delete_receipt(image_filename)
             flash("Что-то пошло не так!", "error")
             logger.error("Возникла непредвиденная ошибка", exc_info=True)
             return render_template("transactions/add.html", form=form)
@@ -239,8 +232,10 @@ def add_transaction():
 @transactions_bp.route("/<int:transaction_id>/edit", methods=["GET", "POST"])
 @login_required
 def edit_transaction(transaction_id):
-    transaction = Transaction.query.filter_by(id=transaction_id).first()
-    if not transaction:
+    transaction, error = get_user_transaction(
+        transaction_id, current_user.id, with_category=False
+    )
+    if error == 404:
         flash("Транзакция не найдена!", "error")
         logger.warning(
             "Попытка найти несуществующую транзакцию",
@@ -253,9 +248,7 @@ def edit_transaction(transaction_id):
         )
         return redirect(url_for("transactions.transaction_main"))
 
-    form = TransactionForm()
-
-    if transaction.user_id != current_user.id:
+    if error == 403:
         flash("У вас недостаточно прав!", "error")
         logger.warning(
             "Попытка редактирования чужой транзакции",
@@ -268,17 +261,18 @@ def edit_transaction(transaction_id):
         )
         return redirect(url_for("transactions.transaction_main"))
 
+    form = TransactionForm()
+
     if form.validate_on_submit():
         old_image_filename = transaction.image_filename
 
+        new_image_filename = None
+
         if form.receipt_image.data:
-            new_image_filename = save_receipt_image(form.receipt_image.data)
+            new_image_filename = save_receipt(form.receipt_image.data)
             if new_image_filename is not None:
                 transaction.image_filename = new_image_filename
-                if old_image_filename and (
-                    old_image_filename != new_image_filename
-                ):
-                    delete_receipt_image(old_image_filename)
+                release_receipt(old_image_filename)
 
         transaction.amount = form.amount.data
         transaction.type = form.type.data
@@ -288,6 +282,8 @@ def edit_transaction(transaction_id):
 
         try:
             db.session.commit()
+            if new_image_filename is not None:
+                delete_receipt(old_image_filename)
             logger.info(
                 "Успешное изменение транзакции",
                 extra={
@@ -301,6 +297,7 @@ def edit_transaction(transaction_id):
             return redirect(url_for("transactions.transaction_main"))
         except Exception:
             db.session.rollback()
+            delete_receipt(new_image_filename)
             flash("Что-то пошло не так!", "error")
             logger.error(
                 "Непредвиденная ошибка при изменении транзакции",
@@ -321,9 +318,11 @@ def edit_transaction(transaction_id):
 @login_required
 def view_transaction(transaction_id):
     """Детальный просмотр транзакции с изображением."""
-    transaction = Transaction.query.filter_by(id=transaction_id).first()
+    transaction, error = get_user_transaction(
+        transaction_id, current_user.id, include_archive=True
+    )
 
-    if not transaction:
+    if error == 404:
         flash("Транзакция не найдена!", "error")
         logger.warning(
             "Попытка найти несуществующую транзакцию",
@@ -336,7 +335,7 @@ def view_transaction(transaction_id):
         )
         return redirect(url_for("transactions.transaction_main"))
 
-    if transaction.user_id != current_user.id:
+    if error == 403:
         flash("У вас недостаточно прав!", "error")
         logger.warning(
             "Попытка просмотра чужой транзакции",
@@ -364,12 +363,30 @@ def view_transaction(transaction_id):
     )
 
 
+@transactions_bp.route("/receipts/<filename>")
+@login_required
+def receipt(filename):
+    """Отдает изображение чека только владельцу транзакции."""
+    if not user_owns_receipt(current_user.id, filename):
+        logger.warning(
+            "Попытка получить чужой или несуществующий чек",
+            extra={
+                "user_id": current_user.id,
+                "filename": filename,
+                "ip": request.remote_addr,
+            },
+        )
+        abort(404)
+    return send_receipt(filename)
+
+
 @transactions_bp.route("/<int:transaction_id>/delete", methods=["POST", "GET"])
 @login_required
 def delete_transaction(transaction_id):
-    form = DeleteConfirmForm()
-    transaction = Transaction.query.filter_by(id=transaction_id).first()
-    if not transaction:
+    transaction, error = get_user_transaction(
+        transaction_id, current_user.id, with_category=False
+    )
+    if error == 404:
         flash("Транзакция не найдена!", "error")
         logger.warning(
             "Попытка найти несуществующую транзакцию",
@@ -382,7 +399,7 @@ def delete_transaction(transaction_id):
         )
         return redirect(url_for("transactions.transaction_main"))
 
-    if transaction.user_id != current_user.id:
+    if error == 403:
         flash("У вас недостаточно прав!", "error")
         logger.warning(
             "Попытка удаления чужой транзакции",
@@ -395,6 +412,8 @@ def delete_transaction(transaction_id):
         )
         return redirect(url_for("transactions.transaction_main"))
 
+    form = DeleteConfirmForm()
+
     if request.method == "GET":
         return render_template(
             "transactions/delete.html", form=form, transaction=transaction
@@ -408,10 +427,11 @@ def delete_transaction(transaction_id):
 
             try:
                 db.session.delete(transaction)
+                release_receipt(image_filename)
                 db.session.commit()
 
                 if image_filename:
-                    delete_receipt_image(image_filename)
+                    delete_receipt(image_filename)
 
                 logger.info(
                     "Успешное удаление транзакции",
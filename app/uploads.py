@@ -0,0 +1,280 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+from collections import namedtuple
+
+import sqlalchemy as sa
+
+from app.db import db, dialect_insert
+from app.models import ReceiptFile
+
+CHUNK_SIZE = 64 * 1024
+
+# Сигнатуры допустимых форматов изображений и их расширения
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpg",
+    b"GIF87a": "gif",
+    b"GIF89a": "gif",
+}
+SIGNATURE_LENGTH = max(len(signature) for signature in IMAGE_SIGNATURES)
+
+# Имя файла с адресацией по содержимому: sha256 и расширение
+CONTENT_ADDRESSED_NAME = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]+)+$")
+
+# Временные файлы stream_upload
+PART_PREFIX = ".upload-"
+PART_SUFFIX = ".part"
+
+StoredUpload = namedtuple(
+    "StoredUpload", ["filename", "sha256", "size", "created", "path"]
+)
+
+
+def image_extension(header):
+    """Расширение по сигнатуре изображения или None."""
+    for signature, ext in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return ext
+    return None
+
+
+def is_image_header(header):
+    """Проверяет, начинается ли файл с сигнатуры изображения."""
+    return image_extension(header) is not None
+
+
+def is_content_addressed(filename):
+    """Проверяет, что имя файла образовано хешем его содержимого."""
+    return bool(CONTENT_ADDRESSED_NAME.match(filename))
+
+
+def shard_relpath(filename):
+    """Путь файла в шардированной раскладке: ab/cd/<имя>."""
+    return os.path.join(filename[:2], filename[2:4], filename)
+
+
+def receipt_relpath(upload_folder, filename):
+    """Относительный путь файла чека внутри папки загрузок.
+
+    Пока идет перенос в шардированную раскладку, файл может еще лежать
+    в корне папки - тогда возвращается старый путь.
+    """
+    relpath = shard_relpath(filename)
+    if not os.path.exists(os.path.join(upload_folder, relpath)) and (
+        os.path.exists(os.path.join(upload_folder, filename))
+    ):
+        return filename
+    return relpath
+
+
+def receipt_path(upload_folder, filename):
+    """Абсолютный путь файла чека с учетом старой плоской раскладки."""
+    return os.path.join(
+        upload_folder, receipt_relpath(upload_folder, filename)
+    )
+
+
+def touch(filepath):
+    """Обновляет mtime файла; False, если файла нет.
+
+    Файл, на который снова ссылаются, для gc-receipts становится
+    свежим и не удаляется, пока транзакция со ссылкой сохраняется.
+    """
+    try:
+        os.utime(filepath)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def discard_stale_parts(upload_folder, min_age, dry_run=False):
+    """Удаляет брошенные временные файлы загрузок старше min_age секунд.
+
+    Такие файлы остаются, если процесс упал посреди stream_upload.
+    Возвращает список удаленных (при dry_run - найденных) файлов.
+    """
+    cutoff = time.time() - min_age
+    stale = []
+    try:
+        entries = os.scandir(upload_folder)
+    except FileNotFoundError:
+        return stale
+    with entries:
+        for entry in entries:
+            if not (
+                entry.name.startswith(PART_PREFIX)
+                and entry.name.endswith(PART_SUFFIX)
+                and entry.is_file()
+            ):
+                continue
+            stat = entry.stat()
+            if stat.st_mtime >= cutoff:
+                continue
+            if not dry_run:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+            stale.append((entry.name, stat.st_size, stat.st_mtime))
+    return stale
+
+
+def stream_upload(stream, upload_folder, max_size):
+    """Потоково сохраняет загруженный файл в папку загрузок.
+
+    Файл читается блоками по CHUNK_SIZE во временный файл в той же папке,
+    по ходу чтения проверяются сигнатура изображения и размер и считается
+    SHA-256. Итоговое имя - хеш содержимого с расширением по сигнатуре:
+    если такой файл уже есть, копия удаляется, иначе временный файл
+    атомарно переименовывается. Бросает ValueError, если файл не прошел
+    проверку.
+    """
+    os.makedirs(upload_folder, exist_ok=True)
+
+    digest = hashlib.sha256()
+    header = b""
+    size = 0
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=upload_folder, prefix=PART_PREFIX, suffix=PART_SUFFIX
+    )
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                if len(header) < SIGNATURE_LENGTH:
+                    header += chunk[:SIGNATURE_LENGTH - len(header)]
+                    if len(header) >= SIGNATURE_LENGTH and (
+                        not is_image_header(header)
+                    ):
+                        raise ValueError("Файл не является изображением")
+
+                size += len(chunk)
+                if size > max_size:
+                    raise ValueError("Превышен допустимый размер файла")
+
+                digest.update(chunk)
+                tmp.write(chunk)
+
+        ext = image_extension(header)
+        if ext is None:
+            raise ValueError("Файл не является изображением")
+
+        sha256 = digest.hexdigest()
+        filename = f"{sha256}.{ext}"
+        filepath = receipt_path(upload_folder, filename)
+        created = not touch(filepath)
+        if created:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            os.replace(tmp_path, filepath)
+        else:
+            os.remove(tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return StoredUpload(filename, sha256, size, created, filepath)
+
+
+def migrate_flat_uploads(upload_folder, batch_size=500):
+    """Переносит одну пачку файлов из корня папки загрузок в шарды.
+
+    Возвращает число перенесенных файлов; 0 означает, что переносить
+    больше нечего. Каждый файл переносится атомарным переименованием,
+    поэтому процесс можно прервать и запустить заново в любой момент.
+    """
+    moved = 0
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if moved >= batch_size:
+                break
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            target = os.path.join(upload_folder, shard_relpath(entry.name))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(entry.path, target)
+            moved += 1
+    return moved
+
+
+def acquire_receipt(filename, size=None, count=1):
+    """Добавляет count ссылок на файл чека в текущую транзакцию БД.
+
+    Счетчик увеличивается одним UPSERT и фиксируется вместе
+    с транзакцией, которая ссылается на файл.
+    """
+    statement = dialect_insert(ReceiptFile).values(
+        filename=filename, size=size, ref_count=count
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[ReceiptFile.filename],
+        set_={"ref_count": ReceiptFile.ref_count + count},
+    )
+    db.session.execute(statement)
+
+
+def restore_receipt(filename, ref_count, size=None):
+    """Записывает точное число ссылок на файл чека в текущую транзакцию БД.
+
+    Нужна, когда счетчик разошелся с транзакциями, например после
+    сбоя между коммитами основной БД и шарда.
+    """
+    statement = dialect_insert(ReceiptFile).values(
+        filename=filename, size=size, ref_count=ref_count
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[ReceiptFile.filename],
+        set_={"ref_count": ref_count},
+    )
+    db.session.execute(statement)
+
+
+def release_receipt(filename):
+    """Снимает ссылку на файл чека в текущей транзакции БД."""
+    if not filename:
+        return
+    db.session.execute(
+        sa.update(ReceiptFile)
+        .where(ReceiptFile.filename == filename)
+        .values(ref_count=ReceiptFile.ref_count - 1)
+    )
+
+
+def forget_unreferenced_receipt(filename):
+    """Удаляет запись о файле чека, если ссылок на него не осталось.
+
+    Возвращает True, если файл больше никому не нужен и его можно
+    удалить с диска.
+    """
+    ref_count = db.session.scalar(
+        sa.select(ReceiptFile.ref_count).where(
+            ReceiptFile.filename == filename
+        )
+    )
+    if ref_count is None:
+        return True
+    if ref_count > 0:
+        return False
+
+    result = db.session.execute(
+        sa.delete(ReceiptFile).where(
+            ReceiptFile.filename == filename, ReceiptFile.ref_count <= 0
+        )
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def forget_receipts(filenames):
+    """Удаляет записи о файлах чеков, которые уже убраны из хранилища."""
+    db.session.execute(
+        sa.delete(ReceiptFile).where(ReceiptFile.filename.in_(filenames))
+    )
+    db.session.commit()
@@ -0,0 +1,11 @@
+"""Бенчмарки горячих путей API и веб-интерфейса.
+
+Запуск из корня проекта:
+
+    python -m benchmarks --sizes 100,1000,10000
+    python -m benchmarks --save-baseline
+    python -m benchmarks --baseline benchmarks/results/baseline.json
+
+Для каждого размера данных поднимается отдельный процесс со своей
+SQLite-базой, заполненной командой `flask seed`.
+"""
@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.compare import compare, format_rows
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_size(size, args):
+    """Прогоняет сценарии на одном размере в отдельном процессе и базе."""
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        env = dict(os.environ)
+        env.update({
+            "FLASK_ENV": "development",
+            "DATABASE_URL": f"sqlite:///{workdir}/bench.db",
+            "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+            "JINJA_BYTECODE_CACHE_DIR": os.path.join(workdir, "jinja"),
+        })
+        env.setdefault("SECRET_KEY", "bench-secret")
+        env.setdefault("JWT_SECRET_KEY", "bench-jwt-secret-" + "x" * 32)
+        output = os.path.join(workdir, "result.json")
+        subprocess.run(
+            [
+                sys.executable, "-m", "benchmarks.worker",
+                "--size", str(size),
+                "--users", str(args.users),
+                "--requests", str(args.requests),
+                "--warmup", str(args.warmup),
+                "--output", output,
+            ],
+            cwd=ROOT, env=env, check=True,
+        )
+        with open(output, encoding="utf-8") as file:
+            return json.load(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Задержки и пропускная способность API и веб-страниц",
+    )
+    parser.add_argument(
+        "--sizes", default="100,1000,10000",
+        help="Транзакций на пользователя, через запятую",
+    )
+    parser.add_argument(
+        "--users", type=int, default=20, help="Пользователей в базе"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=100, help="Замеров на сценарий"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=10, help="Прогревочных запросов"
+    )
+    parser.add_argument(
+        "--output", default=str(RESULTS_DIR / "latest.json"),
+        help="Куда сохранить результаты",
+    )
+    parser.add_argument(
+        "--baseline", help="Базовый прогон для поиска регрессий"
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true",
+        help="Сохранить результаты как benchmarks/results/baseline.json",
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25,
+        help="Допустимый рост p50/p95 относительно базы (0.25 = 25%%)",
+    )
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "users": args.users,
+            "requests": args.requests,
+            "warmup": args.warmup,
+        },
+        "results": {},
+    }
+    for size in (int(value) for value in args.sizes.split(",")):
+        print(f"Размер {size}: заполнение базы и замеры...", flush=True)
+        result = run_size(size, args)
+        results["results"][str(size)] = result
+        for name, stats in result["scenarios"].items():
+            print(
+                f"  {name:<26} p50 {stats['p50_ms']:8.2f} мс  "
+                f"p95 {stats['p95_ms']:8.2f} мс  "
+                f"{stats['rps']:8.1f} зап/с"
+            )
+
+    outputs = [Path(args.output)]
+    if args.save_baseline:
+        outputs.append(RESULTS_DIR / "baseline.json")
+    for path in outputs:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Результаты сохранены в {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        rows = compare(results, baseline, args.tolerance)
+        print(format_rows(rows))
+        regressions = [row for row in rows if row["regressed"]]
+        if regressions:
+            print(f"Регрессий: {len(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Сравнение результатов бенчмарка с сохраненным базовым прогоном."""
+
+# Метрики, рост которых считается регрессией
+METRICS = ("p50_ms", "p95_ms")
+
+
+def compare(results, baseline, tolerance):
+    """Строки сравнения по сценариям, которые есть в обоих прогонах.
+
+    Регрессия - метрика выросла больше чем в (1 + tolerance) раз.
+    Возвращает список словарей с полем regressed.
+    """
+    rows = []
+    for size, current in results["results"].items():
+        previous = baseline["results"].get(size)
+        if previous is None:
+            continue
+        for name, stats in current["scenarios"].items():
+            base_stats = previous["scenarios"].get(name)
+            if base_stats is None:
+                continue
+            for metric in METRICS:
+                ratio = stats[metric] / max(base_stats[metric], 1e-9)
+                rows.append({
+                    "size": size,
+                    "scenario": name,
+                    "metric": metric,
+                    "baseline": base_stats[metric],
+                    "current": stats[metric],
+                    "ratio": ratio,
+                    "regressed": ratio > 1 + tolerance,
+                })
+    return rows
+
+
+def format_rows(rows):
+    """Таблица сравнения для вывода в консоль."""
+    lines = [
+        f"{'размер':>8} {'сценарий':<26} {'метрика':<8} "
+        f"{'было':>9} {'стало':>9} {'изм.':>7}"
+    ]
+    for row in rows:
+        mark = "  <- регрессия" if row["regressed"] else ""
+        lines.append(
+            f"{row['size']:>8} {row['scenario']:<26} {row['metric']:<8} "
+            f"{row['baseline']:>9.2f} {row['current']:>9.2f} "
+            f"{(row['ratio'] - 1) * 100:>+6.0f}%{mark}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,514 @@
+"""Нагрузочный тест API с замкнутым циклом и проверкой SLO.
+
+Виртуальные пользователи входят под своими учетками и в цикле выполняют
+случайные операции из смеси (--mix), дожидаясь ответа перед следующим
+запросом. HTTP-клиент написан на asyncio-потоках, так что тест не
+требует сторонних пакетов и работает без сети против локального сервера.
+
+Пользователей удобно создать командой seed, она печатает префикс имен:
+
+    flask seed --users 50 --transactions-per-user 1000
+    flask run --with-threads
+    python -m benchmarks.load --user-prefix seed1a2b3c --user-count 50 \\
+        --vus 50 --duration 60 --slo list:p95_ms=300
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import struct
+import sys
+import time
+import uuid
+import zlib
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+DEFAULT_MIX = {
+    "login": 2,
+    "refresh": 3,
+    "list": 30,
+    "create": 20,
+    "create_receipt": 5,
+    "update": 20,
+    "update_receipt": 5,
+    "delete": 15,
+}
+
+# SLO по умолчанию для всех операций ("*") и отдельных операций
+DEFAULT_SLOS = {
+    "*": {"p95_ms": 500, "p99_ms": 1000, "error_rate": 0.01},
+    "login": {"p95_ms": 1000, "p99_ms": 2000},
+    "list": {"p95_ms": 1000, "p99_ms": 2000},
+}
+
+
+class HttpError(Exception):
+    pass
+
+
+class HttpClient:
+    """Минимальный HTTP/1.1 клиент с keep-alive поверх asyncio.
+
+    Одно соединение на виртуального пользователя; если сервер закрывает
+    соединение, следующий запрос открывает новое.
+    """
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        if parts.scheme != "http":
+            raise ValueError("Поддерживается только http://")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.reader = self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.reader = self.writer = None
+
+    async def request(self, method, path, headers=None, body=b""):
+        """Возвращает (статус, тело). Ошибки сети - исключения."""
+        try:
+            return await asyncio.wait_for(
+                self._request(method, path, headers or {}, body),
+                self.timeout,
+            )
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _request(self, method, path, headers, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+        lines = [
+            f"{method} {self.base_path}{path} HTTP/1.1",
+            f"Host: {self.host}:{self.port}",
+            f"Content-Length: {len(body)}",
+        ]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        self.writer.write(head + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise HttpError("Сервер закрыл соединение")
+        version, status = status_line.decode("latin-1").split()[:2]
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if "content-length" in response_headers:
+            data = await self.reader.readexactly(
+                int(response_headers["content-length"])
+            )
+        elif response_headers.get("transfer-encoding") == "chunked":
+            data = await self._read_chunked()
+        else:
+            data = await self.reader.read()
+            response_headers["connection"] = "close"
+
+        connection = response_headers.get("connection", "").lower()
+        if connection == "close" or (
+            version == "HTTP/1.0" and connection != "keep-alive"
+        ):
+            await self.close()
+        return int(status), data
+
+    async def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                await self.reader.readline()
+                return b"".join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+
+
+def make_png(rng):
+    """Маленький PNG со случайными пикселями - каждый чек уникален."""
+    width = height = 32
+    raw = b"".join(
+        b"\x00" + rng.randbytes(width * 3) for _ in range(height)
+    )
+
+    def chunk(kind, data):
+        return (
+            struct.pack(">I", len(data)) + kind + data
+            + struct.pack(">I", zlib.crc32(kind + data))
+        )
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+    )
+
+
+def multipart(fields, file_field, filename, content, content_type):
+    """Тело multipart/form-data и соответствующий заголовок."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f"--{boundary}\r\nContent-Disposition: form-data; "
+            f"name=\"{name}\"\r\n\r\n{value}\r\n".encode()
+        )
+    parts.append(
+        f"--{boundary}\r\nContent-Disposition: form-data; "
+        f"name=\"{file_field}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: {content_type}\r\n\r\n".encode()
+        + content + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class VirtualUser:
+    """Один клиент API: свои токены и свои созданные транзакции."""
+
+    def __init__(self, client, username, password, category_ids, rng,
+                 record):
+        self.client = client
+        self.username = username
+        self.password = password
+        self.category_ids = category_ids
+        self.rng = rng
+        self.record = record
+        self.access_token = None
+        self.refresh_token = None
+        self.transaction_ids = []
+
+    async def call(self, operation, method, path, json_body=None,
+                   body=b"", content_type=None, token=None):
+        """Выполняет запрос и записывает задержку под именем операции."""
+        headers = {}
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            content_type = "application/json"
+        if content_type:
+            headers["Content-Type"] = content_type
+        token = token or self.access_token
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+
+        started = time.perf_counter()
+        try:
+            status, data = await self.client.request(
+                method, path, headers, body
+            )
+        except (OSError, asyncio.TimeoutError, HttpError, ValueError):
+            self.record(operation, time.perf_counter() - started, None)
+            return None, None
+        self.record(operation, time.perf_counter() - started, status)
+        if status == 401 and operation not in ("login", "refresh"):
+            await self.login()
+        if not 200 <= status < 300 or status == 204:
+            return status, None
+        try:
+            return status, json.loads(data)
+        except ValueError:
+            return status, None
+
+    async def login(self):
+        _, data = await self.call(
+            "login", "POST", "/api/auth/login",
+            json_body={"username": self.username, "password": self.password},
+        )
+        if data:
+            self.access_token = data["access_token"]
+            self.refresh_token = data["refresh_token"]
+        return data is not None
+
+    async def refresh(self):
+        if not self.refresh_token:
+            return await self.login()
+        _, data = await self.call(
+            "refresh", "POST", "/api/auth/refresh",
+            token=self.refresh_token,
+        )
+        if data:
+            self.access_token = data["access_token"]
+
+    async def list(self):
+        await self.call("list", "GET", "/api/transactions")
+
+    def transaction_fields(self):
+        return {
+            "amount": round(self.rng.lognormvariate(6.5, 1), 2),
+            "type": self.rng.choice(("expense", "expense", "income")),
+            "description": f"Нагрузка {self.rng.randrange(10 ** 6)}",
+            "category_id": self.rng.choice(self.category_ids),
+        }
+
+    async def create(self):
+        _, data = await self.call(
+            "create", "POST", "/api/transactions",
+            json_body=self.transaction_fields(),
+        )
+        if data:
+            self.transaction_ids.append(data["transaction"]["id"])
+
+    async def create_receipt(self):
+        body, content_type = multipart(
+            self.transaction_fields(), "receipt_image", "receipt.png",
+            make_png(self.rng), "image/png",
+        )
+        _, data = await self.call(
+            "create_receipt", "POST", "/api/transactions",
+            body=body, content_type=content_type,
+        )
+        if data:
+            self.transaction_ids.append(data["transaction"]["id"])
+
+    async def update(self):
+        if not self.transaction_ids:
+            return await self.create()
+        await self.call(
+            "update", "PUT",
+            f"/api/transactions/{self.rng.choice(self.transaction_ids)}",
+            json_body={"description": f"Изменено {self.rng.random():.6f}"},
+        )
+
+    async def update_receipt(self):
+        if not self.transaction_ids:
+            return await self.create_receipt()
+        body, content_type = multipart(
+            {"description": "Чек заменен"}, "receipt_image", "receipt.png",
+            make_png(self.rng), "image/png",
+        )
+        await self.call(
+            "update_receipt", "PUT",
+            f"/api/transactions/{self.rng.choice(self.transaction_ids)}",
+            body=body, content_type=content_type,
+        )
+
+    async def delete(self):
+        if not self.transaction_ids:
+            return await self.create()
+        transaction_id = self.transaction_ids.pop(
+            self.rng.randrange(len(self.transaction_ids))
+        )
+        await self.call(
+            "delete", "DELETE", f"/api/transactions/{transaction_id}"
+        )
+
+    async def run(self, mix, deadline, think_time):
+        if not await self.login():
+            return
+        operations = list(mix)
+        weights = list(mix.values())
+        while time.monotonic() < deadline:
+            operation = self.rng.choices(operations, weights=weights)[0]
+            await getattr(self, operation)()
+            if think_time:
+                await asyncio.sleep(self.rng.expovariate(1 / think_time))
+
+
+def percentile_stats(latencies):
+    if len(latencies) < 2:
+        value = latencies[0] * 1000 if latencies else 0.0
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+    }
+
+
+def build_report(samples, duration):
+    """Статистика по операциям из записей (задержка, статус)."""
+    report = {}
+    for operation, records in sorted(samples.items()):
+        latencies = [latency for latency, _ in records]
+        errors = sum(
+            1 for _, status in records
+            if status is None or status >= 400
+        )
+        report[operation] = {
+            "requests": len(records),
+            "errors": errors,
+            "error_rate": errors / len(records),
+            "rps": len(records) / duration,
+            **percentile_stats(latencies),
+        }
+    return report
+
+
+def check_slos(report, slos):
+    """Нарушения SLO: список (операция, метрика, значение, порог)."""
+    violations = []
+    for operation, stats in report.items():
+        limits = {**slos.get("*", {}), **slos.get(operation, {})}
+        for metric, limit in limits.items():
+            if stats[metric] > limit:
+                violations.append((operation, metric, stats[metric], limit))
+    return violations
+
+
+def parse_pairs(values, cast):
+    """Разбирает значения вида name=value (через запятую) в словарь."""
+    result = {}
+    for item in ",".join(values).split(","):
+        if item:
+            name, _, value = item.partition("=")
+            result[name.strip()] = cast(value)
+    return result
+
+
+def parse_slos(values, slo_file):
+    slos = {name: dict(limits) for name, limits in DEFAULT_SLOS.items()}
+    if slo_file:
+        with open(slo_file, encoding="utf-8") as file:
+            for name, limits in json.load(file).items():
+                slos.setdefault(name, {}).update(limits)
+    # --slo list:p95_ms=300,error_rate=0.02
+    for value in values:
+        name, _, limits = value.partition(":")
+        slos.setdefault(name, {}).update(parse_pairs([limits], float))
+    return slos
+
+
+async def load_categories(args, username):
+    client = HttpClient(args.url, args.timeout)
+    user = VirtualUser(client, username, args.password, [], None,
+                       lambda *record: None)
+    try:
+        if not await user.login():
+            raise SystemExit(f"Не удалось войти как {username}")
+        _, data = await user.call("categories", "GET", "/api/categories")
+    finally:
+        await client.close()
+    if not data or not data["categories"]:
+        raise SystemExit("В базе нет категорий, запустите flask seed")
+    return [category["id"] for category in data["categories"]]
+
+
+async def run_load(args, mix):
+    usernames = [
+        f"{args.user_prefix}_{index}" for index in range(args.user_count)
+    ]
+    category_ids = await load_categories(args, usernames[0])
+    samples = defaultdict(list)
+
+    def record(operation, latency, status):
+        samples[operation].append((latency, status))
+
+    rng = random.Random(args.random_seed)
+    started = time.monotonic()
+    deadline = started + args.duration
+    clients, tasks = [], []
+    for index in range(args.vus):
+        client = HttpClient(args.url, args.timeout)
+        clients.append(client)
+        user = VirtualUser(
+            client, usernames[index % len(usernames)], args.password,
+            category_ids, random.Random(rng.randrange(2 ** 32)), record,
+        )
+
+        async def start(user=user, delay=args.ramp_up * index / args.vus):
+            await asyncio.sleep(delay)
+            await user.run(mix, deadline, args.think_time)
+
+        tasks.append(asyncio.create_task(start()))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for client in clients:
+            await client.close()
+    return build_report(samples, time.monotonic() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.load",
+        description="Нагрузочный тест API с отчетом по SLO",
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument(
+        "--user-prefix", required=True,
+        help="Префикс имен пользователей из flask seed",
+    )
+    parser.add_argument("--user-count", type=int, default=10)
+    parser.add_argument("--password", default="password1")
+    parser.add_argument(
+        "--vus", type=int, default=20, help="Виртуальных пользователей"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="Длительность, с"
+    )
+    parser.add_argument(
+        "--ramp-up", type=float, default=5,
+        help="За сколько секунд стартуют все пользователи",
+    )
+    parser.add_argument(
+        "--think-time", type=float, default=0,
+        help="Средняя пауза между запросами, с",
+    )
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument(
+        "--mix", action="append", default=[],
+        help="Веса операций, например list=50,delete=0",
+    )
+    parser.add_argument(
+        "--slo", action="append", default=[],
+        help="Порог, например list:p95_ms=300,error_rate=0.02",
+    )
+    parser.add_argument("--slo-file", help="JSON с порогами по операциям")
+    parser.add_argument("--output", help="Сохранить отчет в JSON")
+    parser.add_argument("--random-seed", type=int)
+    args = parser.parse_args()
+
+    mix = {**DEFAULT_MIX, **parse_pairs(args.mix, float)}
+    unknown = set(mix) - set(DEFAULT_MIX)
+    if unknown:
+        parser.error(f"Неизвестные операции: {', '.join(sorted(unknown))}")
+    mix = {name: weight for name, weight in mix.items() if weight > 0}
+    slos = parse_slos(args.slo, args.slo_file)
+
+    report = asyncio.run(run_load(args, mix))
+    violations = check_slos(report, slos)
+
+    print(
+        f"{'операция':<16} {'запросов':>9} {'ошибок':>7} {'зап/с':>8} "
+        f"{'p50':>8} {'p95':>8} {'p99':>8}"
+    )
+    for operation, stats in report.items():
+        print(
+            f"{operation:<16} {stats['requests']:>9} "
+            f"{stats['error_rate']:>6.1%} {stats['rps']:>8.1f} "
+            f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} "
+            f"{stats['p99_ms']:>8.1f}"
+        )
+    for operation, metric, value, limit in violations:
+        print(f"SLO нарушен: {operation} {metric} = {value:.3f} > {limit}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {"report": report, "slos": slos, "violations": violations},
+                file, indent=2,
+            )
+    if violations:
+        sys.exit(1)
+    print("Все SLO соблюдены")
+
+
+if __name__ == "__main__":
+    main()
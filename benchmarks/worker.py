@@ -0,0 +1,232 @@
+"""Прогон сценариев на одном размере данных.
+
+Запускается отдельным процессом из `python -m benchmarks`: конфиг
+приложения читает переменные окружения при импорте, поэтому своя база
+на каждый размер требует своего процесса.
+"""
+import argparse
+import html
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import sqlalchemy as sa
+
+from app import create_app
+from app.db import db
+from app.log import output_handlers
+from app.models import Category, Transaction, User
+
+PASSWORD = "bench-password"
+# Все транзакции: по умолчанию фильтр показывает только сегодняшние
+WEB_LIST_URL = "/transactions/?period=all_time&transaction_type=all"
+# Глубина страницы для замера keyset-пагинации
+CURSOR_PAGE_DEPTH = 10
+
+
+def summarize(latencies, elapsed):
+    """Задержки в миллисекундах и пропускная способность сценария."""
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+        "max_ms": max(latencies) * 1000,
+        "rps": len(latencies) / elapsed,
+    }
+
+
+def measure(name, send, expected_status, requests, warmup):
+    """Выполняет сценарий warmup + requests раз, замеряя только requests.
+
+    send получает порядковый номер запроса, чтобы сценарии могли
+    перебирать разные транзакции.
+    """
+    latencies = []
+    started = None
+    for index in range(warmup + requests):
+        if index == warmup:
+            started = time.perf_counter()
+        request_started = time.perf_counter()
+        response = send(index)
+        if index >= warmup:
+            latencies.append(time.perf_counter() - request_started)
+        if response.status_code != expected_status:
+            raise RuntimeError(
+                f"{name}: ожидался статус {expected_status}, получен "
+                f"{response.status_code}: {response.get_data(True)[:200]}"
+            )
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def prepare_database(app, users, size):
+    """Создает схему миграциями и заполняет ее командой seed.
+
+    Первому пользователю ставится настоящий хеш пароля, чтобы вход
+    замерялся с той же стоимостью, что и в проде.
+    """
+    # Миграции - отдельным процессом: fileConfig из migrations/env.py
+    # заменил бы обработчики логов приложения и выключил его логгеры
+    upgrade = subprocess.run(
+        [sys.executable, "-m", "flask", "--app", "run", "db", "upgrade"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+    )
+    if upgrade.returncode != 0:
+        raise RuntimeError(f"flask db upgrade: {upgrade.stderr}")
+
+    args = ["seed", "--users", str(users),
+            "--transactions-per-user", str(size), "--random-seed", "1"]
+    result = app.test_cli_runner().invoke(args=args)
+    if result.exit_code != 0:
+        raise RuntimeError(
+            f"flask {' '.join(args)}: {result.output}"
+        ) from result.exception
+
+    user = db.session.scalars(sa.select(User).order_by(User.id)).first()
+    user.set_password(PASSWORD)
+    db.session.commit()
+    transaction_ids = db.session.scalars(
+        sa.select(Transaction.id)
+        .where(Transaction.user_id == user.id)
+        .order_by(Transaction.id)
+    ).all()
+    category_id = db.session.scalar(sa.select(sa.func.min(Category.id)))
+    return user.username, transaction_ids, category_id
+
+
+def find_cursor_url(web, url, depth):
+    """URL страницы списка, до которой depth раз перешли по "дальше".
+
+    Если страниц меньше, возвращает последнюю из них.
+    """
+    for _ in range(depth):
+        body = web.get(url).get_data(as_text=True)
+        match = re.search(r'href="([^"]*[?&]cursor=[^"]*)"', body)
+        if match is None:
+            break
+        url = html.unescape(match.group(1))
+    return url
+
+
+def build_scenarios(app, username, transaction_ids, category_id):
+    """Сценарии в порядке выполнения: (имя, функция, ожидаемый статус).
+
+    Удаление идет после создания и удаляет созданные им транзакции,
+    так что объем данных между сценариями не меняется.
+    """
+    api = app.test_client()
+    login = api.post(
+        "/api/auth/login", json={"username": username, "password": PASSWORD}
+    )
+    headers = {
+        "Authorization": f"Bearer {login.get_json()['access_token']}"
+    }
+
+    web = app.test_client()
+    web.post(
+        "/auth/login", data={"valid_data": username, "password": PASSWORD}
+    )
+
+    cursor_url = find_cursor_url(web, WEB_LIST_URL, CURSOR_PAGE_DEPTH)
+    created = []
+
+    def pick(index):
+        return transaction_ids[index % len(transaction_ids)]
+
+    def create(index):
+        response = api.post("/api/transactions", headers=headers, json={
+            "amount": 100 + index,
+            "type": "expense",
+            "description": f"Бенчмарк {index}",
+            "category_id": category_id,
+        })
+        if response.status_code == 201:
+            created.append(response.get_json()["transaction"]["id"])
+        return response
+
+    return [
+        ("api_login", lambda index: api.post(
+            "/api/auth/login",
+            json={"username": username, "password": PASSWORD},
+        ), 200),
+        ("api_transactions_list", lambda index: api.get(
+            "/api/transactions", headers=headers
+        ), 200),
+        ("api_transactions_create", create, 201),
+        ("api_transaction_get", lambda index: api.get(
+            f"/api/transactions/{pick(index)}", headers=headers
+        ), 200),
+        ("api_transaction_update", lambda index: api.put(
+            f"/api/transactions/{pick(index)}", headers=headers,
+            json={"description": f"Изменено {index}"},
+        ), 200),
+        ("api_transaction_delete", lambda index: api.delete(
+            f"/api/transactions/{created.pop()}", headers=headers
+        ), 204),
+        ("api_categories", lambda index: api.get(
+            "/api/categories", headers=headers
+        ), 200),
+        ("api_profile", lambda index: api.get(
+            "/api/profile", headers=headers
+        ), 200),
+        ("web_transaction_main", lambda index: web.get(WEB_LIST_URL), 200),
+        ("web_transaction_page", lambda index: web.get(cursor_url), 200),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, required=True)
+    parser.add_argument("--users", type=int, required=True)
+    parser.add_argument("--requests", type=int, required=True)
+    parser.add_argument("--warmup", type=int, required=True)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+    # Логи проходят весь путь до записи, как в проде, но пишутся
+    # в никуда, чтобы не засорять вывод бенчмарка
+    devnull = open(os.devnull, "w")
+    for handler in output_handlers():
+        handler.setStream(devnull)
+
+    with app.app_context():
+        started = time.perf_counter()
+        username, transaction_ids, category_id = prepare_database(
+            app, args.users, args.size
+        )
+        seed_seconds = time.perf_counter() - started
+
+    # Запросы идут вне контекста приложения: как в проде, каждый
+    # поднимает свой, и g, сессия БД и кеши не переживают запрос
+    scenarios = {}
+    for name, send, expected_status in build_scenarios(
+        app, username, transaction_ids, category_id
+    ):
+        scenarios[name] = measure(
+            name, send, expected_status, args.requests, args.warmup
+        )
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "size": args.size,
+                "users": args.users,
+                "seed_seconds": seed_seconds,
+                "scenarios": scenarios,
+            },
+            file,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 from pathlib import Path
 from datetime import timedelta
@@ -20,26 +21,169 @@ class Config:
         "DATABASE_URL", f"sqlite:///{BASE_DIR}/instance/database.db"
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Реплики только для чтения через запятую. GET-запросы читают с них,
+    # а после записи клиент REPLICA_STICKY_SECONDS секунд читает из
+    # основной БД (секунды должны покрывать задержку репликации). Клиента
+    # узнают по cookie, заголовку X-DB-Primary-Until или пользователю JWT
+    SQLALCHEMY_REPLICA_URIS = [
+        uri for uri in os.environ.get("DATABASE_REPLICA_URLS", "").split(",")
+        if uri
+    ]
+    REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 5))
+    # Шарды для пользовательских таблиц (transaction и ее архив) через
+    # запятую; user, category и чеки остаются в основной БД. Пользователь
+    # живет в шарде user_id % N, так что N фиксируется с первыми данными
+    SQLALCHEMY_SHARD_URIS = [
+        uri for uri in os.environ.get("DATABASE_SHARD_URLS", "").split(",")
+        if uri
+    ]
+    # Выполняются при каждом подключении к SQLite, порядок важен:
+    # busy_timeout нужен до смены журнала, которая берет блокировку.
+    # WAL позволяет читать во время записи, NORMAL в WAL не теряет
+    # целостность при сбое, а лишь последние транзакции при отказе ОС.
+    # cache_size в минус-КиБ (64 МБ), mmap_size в байтах (256 МБ)
+    SQLITE_PRAGMAS = {
+        "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "foreign_keys": "ON",
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    }
     REMEMBER_COOKIE_DURATION = timedelta(days=30)
     REMEMBER_COOKIE_HTTPONLY = True
     SESSION_PROTECTION = "strong"
-    UPLOAD_FOLDER = os.path.join(
+    UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER") or os.path.join(
         os.path.dirname(os.path.abspath(__file__)),
         'app', 'static', 'uploads', 'transactions'
     )
     MAX_CONTENT_LENGTH = 5 * 1024 * 1024  # 5MB
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    # Отдача чеков через фронтовой сервер: X-Sendfile (Apache, lighttpd)
+    # или X-Accel-Redirect с префиксом internal-локации nginx
+    USE_X_SENDFILE = os.environ.get("USE_X_SENDFILE", "False") == "True"
+    RECEIPTS_ACCEL_REDIRECT_PREFIX = os.environ.get(
+        "RECEIPTS_ACCEL_REDIRECT_PREFIX"
+    )
+    RECEIPT_CACHE_MAX_AGE = 365 * 24 * 3600
+    # Хранилище чеков: local (UPLOAD_FOLDER) или s3 (S3-совместимое).
+    # Ключи доступа к S3 boto3 берет из AWS_ACCESS_KEY_ID и т.д.
+    RECEIPT_STORAGE = os.environ.get("RECEIPT_STORAGE", "local")
+    S3_BUCKET = os.environ.get("S3_BUCKET")
+    S3_PREFIX = os.environ.get("S3_PREFIX", "receipts/")
+    S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+    S3_REGION = os.environ.get("S3_REGION")
+    S3_PRESIGN_EXPIRES = int(os.environ.get("S3_PRESIGN_EXPIRES", 300))
+    # Прямые загрузки до переноса в S3_PREFIX; вне S3_PREFIX, чтобы их не
+    # видел gc-receipts. Незабранные удаляет правило жизненного цикла
+    # бакета (например, через сутки)
+    S3_INCOMING_PREFIX = os.environ.get(
+        "S3_INCOMING_PREFIX", "receipts-incoming/"
+    )
+    # Сколько секунд действует receipt_token прямой загрузки
+    RECEIPT_UPLOAD_TOKEN_MAX_AGE = int(
+        os.environ.get("RECEIPT_UPLOAD_TOKEN_MAX_AGE", 3600)
+    )
+    # Временная папка для загрузок перед отправкой в бакет
+    S3_SPOOL_FOLDER = os.environ.get("S3_SPOOL_FOLDER") or os.path.join(
+        tempfile.gettempdir(), "receipts-spool"
+    )
+    # Фоновое создание уменьшенных WebP/AVIF вариантов чеков
+    RECEIPT_VARIANT_SIZES = {'thumb': 200, 'medium': 800}
+    RECEIPT_VARIANT_QUALITY = 80
+    RECEIPT_VARIANT_WORKERS = 2
+    # Больше - не декодируется: защита пула от "бомб" распаковки
+    RECEIPT_MAX_PIXELS = int(os.environ.get("RECEIPT_MAX_PIXELS", 50_000_000))
+    TRANSACTIONS_PER_PAGE = 50
+    # Категории общие для всех пользователей, поэтому добавлять их через
+    # API могут только перечисленные id; по умолчанию никто, а основной
+    # путь - команда flask add-categories
+    CATEGORY_ADMIN_IDS = {
+        int(user_id)
+        for user_id in os.environ.get("CATEGORY_ADMIN_IDS", "").split(",")
+        if user_id.strip()
+    }
+    # Групповая запись: POST /api/transactions без чека ждет до
+    # WRITE_COALESCE_WINDOW_MS соседних запросов и коммитит их вместе
+    TRANSACTION_WRITE_COALESCING = (
+        os.environ.get("TRANSACTION_WRITE_COALESCING", "False") == "True"
+    )
+    WRITE_COALESCE_WINDOW_MS = int(
+        os.environ.get("WRITE_COALESCE_WINDOW_MS", 5)
+    )
+    WRITE_COALESCE_MAX_BATCH = 200
+    WRITE_COALESCE_TIMEOUT = 30
+    # Каталог байткод-кеша Jinja, по умолчанию instance/jinja_cache
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get("JINJA_BYTECODE_CACHE_DIR")
+    FRAGMENT_CACHE_MAX_ENTRIES = 10000
+    # Счетчик запросов к БД на HTTP-запрос. Server-Timing раскрывает
+    # время в БД клиенту, поэтому по умолчанию включен только в dev
+    SQL_INSTRUMENTATION = (
+        os.environ.get("SQL_INSTRUMENTATION", "True") == "True"
+    )
+    SQL_SERVER_TIMING = os.environ.get("SQL_SERVER_TIMING", "False") == "True"
+    # Уровень итоговой записи о запросах к БД на каждый HTTP-запрос
+    SQL_STATS_LOG_LEVEL = os.environ.get("SQL_STATS_LOG_LEVEL", "INFO")
+    # Профилирование запроса по заголовку X-Profile-Token или ?_profile=
+    # с этим токеном; без токена профилировщик не подключается вовсе.
+    # Профили пишутся в PROFILE_DIR, по умолчанию instance/profiles
+    PROFILER_TOKEN = os.environ.get("PROFILER_TOKEN")
+    PROFILE_DIR = os.environ.get("PROFILE_DIR")
+    # Логи пишет в stderr фоновый поток, запросы лишь кладут записи в
+    # очередь (LOG_ASYNC). LOG_JSON - одна JSON-строка на запись.
+    # LOG_SAMPLING - доля INFO-записей, попадающих в лог, по логгерам:
+    # "app.api.resources.transactions=0.1,app.auth=0.5"
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+    LOG_ASYNC = os.environ.get("LOG_ASYNC", "True") == "True"
+    LOG_JSON = os.environ.get("LOG_JSON", "False") == "True"
+    LOG_SAMPLING = {
+        name: float(rate)
+        for name, _, rate in (
+            item.partition("=")
+            for item in os.environ.get("LOG_SAMPLING", "").split(",")
+            if item
+        )
+    }
+    # Метрики Prometheus на /metrics; METRICS_TOKEN, если задан,
+    # требуется в заголовке Authorization: Bearer. Без токена /metrics
+    # открыт только при METRICS_PUBLIC (в проде по умолчанию выключен)
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True") == "True"
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+    METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", "True") == "True"
+    # Сколько одинаковых запросов за HTTP-запрос считать признаком N+1
+    SQL_N_PLUS_ONE_THRESHOLD = int(
+        os.environ.get("SQL_N_PLUS_ONE_THRESHOLD", 10)
+    )
 
 
 class DevelopmentConfig(Config):
     TEMPLATES_AUTO_RELOAD = True
     SQLALCHEMY_ECHO = False
+    SQLALCHEMY_ENGINE_OPTIONS = {"pool_size": 5, "max_overflow": 5}
+    SQL_SERVER_TIMING = True
 
 
 class ProductionConfig(Config):
     DEBUG = False
+    LOG_JSON = os.environ.get("LOG_JSON", "True") == "True"
+    # Имена маршрутов и состояние пула не для посторонних
+    METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", "False") == "True"
     SESSION_COOKIE_SECURE = True
     REMEMBER_COOKIE_SECURE = True
+    # Пул соединений на процесс воркера: pool_size постоянных соединений
+    # и до max_overflow временных сверх них при пиках. pool_recycle
+    # пересоздает соединения старше получаса, чтобы не упираться в
+    # таймауты сервера БД и прокси, pool_pre_ping отбрасывает оборванные.
+    # Для SQLite пул тоже полезен: прагмы выполняются один раз на
+    # соединение, а не на каждый запрос
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 20)),
+        "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": True,
+    }
 
 
 class TestConfig(Config):
@@ -94,17 +94,37 @@ def run_migrations_online():
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
 
-    connectable = get_engine()
+    for name, connectable in get_target_engines():
+        logger.info('Migrating database %s', name)
+        with connectable.connect() as connection:
+            context.configure(
+                connection=connection,
+                target_metadata=get_metadata(),
+                **conf_args
+            )
 
-    with connectable.connect() as connection:
-        context.configure(
-            connection=connection,
-            target_metadata=get_metadata(),
-            **conf_args
-        )
+            with context.begin_transaction():
+                context.run_migrations()
 
-        with context.begin_transaction():
-            context.run_migrations()
+
+def get_target_engines():
+    """Базы для миграции: основная и все шарды с той же схемой.
+
+    `flask db upgrade -x shard=shard_1` мигрирует один шард,
+    `-x shard=main` - только основную БД. Автогенерация всегда
+    сравнивает схему только с основной БД.
+    """
+    target = context.get_x_argument(as_dictionary=True).get('shard')
+    shards = current_app.extensions.get('db_shards') or []
+    if target == 'main' or getattr(config.cmd_opts, 'autogenerate', False):
+        return [('main', get_engine())]
+    if target:
+        if target not in shards:
+            raise ValueError(f'Неизвестный шард {target}')
+        return [(target, target_db.engines[target])]
+    return [('main', get_engine())] + [
+        (key, target_db.engines[key]) for key in shards
+    ]
 
 
 if context.is_offline_mode():
@@ -0,0 +1,41 @@
+"""store transaction amount in minor units
+
+Revision ID: 5b1f2c8e9a47
+Revises: e816ff418378
+Create Date: 2026-10-19 10:12:41.305118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1f2c8e9a47'
+down_revision = 'e816ff418378'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('amount_cents', sa.BigInteger(), nullable=True))
+
+    op.execute(
+        'UPDATE "transaction" '
+        'SET amount_cents = CAST(ROUND(amount * 100) AS INTEGER)'
+    )
+
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.alter_column('amount_cents', existing_type=sa.BigInteger(), nullable=False)
+        batch_op.drop_column('amount')
+
+
+def downgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('amount', sa.Numeric(precision=10, scale=2), nullable=True))
+
+    op.execute('UPDATE "transaction" SET amount = amount_cents / 100.0')
+
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.alter_column('amount', existing_type=sa.Numeric(precision=10, scale=2), nullable=False)
+        batch_op.drop_column('amount_cents')
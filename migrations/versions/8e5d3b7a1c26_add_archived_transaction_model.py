@@ -0,0 +1,45 @@
+"""add ArchivedTransaction model
+
+Revision ID: 8e5d3b7a1c26
+Revises: f2a9c7e31b64
+Create Date: 2026-10-19 13:42:09.518377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e5d3b7a1c26'
+down_revision = 'f2a9c7e31b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('archived_transaction',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+    sa.Column('type', sa.String(length=50), nullable=False),
+    sa.Column('description', sa.String(length=100), nullable=False),
+    sa.Column('date', sa.DateTime(), nullable=False),
+    sa.Column('image_filename', sa.String(length=200), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['category.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('archived_transaction', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_archived_transaction_image_filename'), ['image_filename'], unique=False)
+        batch_op.create_index('ix_archived_transaction_user_id_date_id', ['user_id', 'date', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('archived_transaction', schema=None) as batch_op:
+        batch_op.drop_index('ix_archived_transaction_user_id_date_id')
+        batch_op.drop_index(batch_op.f('ix_archived_transaction_image_filename'))
+
+    op.drop_table('archived_transaction')
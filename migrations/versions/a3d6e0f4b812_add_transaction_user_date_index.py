@@ -0,0 +1,26 @@
+"""add (user_id, date, id) index to Transaction
+
+Revision ID: a3d6e0f4b812
+Revises: 5b1f2c8e9a47
+Create Date: 2026-10-19 11:02:17.648390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d6e0f4b812'
+down_revision = '5b1f2c8e9a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.create_index('ix_transaction_user_id_date_id', ['user_id', 'date', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_index('ix_transaction_user_id_date_id')
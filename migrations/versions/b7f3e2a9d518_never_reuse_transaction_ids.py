@@ -0,0 +1,43 @@
+"""never reuse Transaction ids
+
+Revision ID: b7f3e2a9d518
+Revises: 8e5d3b7a1c26
+Create Date: 2026-10-19 15:21:37.604915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7f3e2a9d518'
+down_revision = '8e5d3b7a1c26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Без AUTOINCREMENT SQLite выдает max(id) + 1, и id транзакций,
+    # перенесенных в архив, достаются новым строкам. Последовательности
+    # PostgreSQL назад не идут, там пересоздавать нечего.
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    with op.batch_alter_table('transaction', schema=None, recreate='always', table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+
+    # Счетчик должен пропустить и id, уже ушедшие в архив
+    op.execute("DELETE FROM sqlite_sequence WHERE name = 'transaction'")
+    op.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'transaction', max("
+        'coalesce((SELECT max(id) FROM "transaction"), 0), '
+        'coalesce((SELECT max(id) FROM archived_transaction), 0))'
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    with op.batch_alter_table('transaction', schema=None, recreate='always', table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+        pass
@@ -0,0 +1,28 @@
+"""add updated_at field to Transaction
+
+Revision ID: c71e4a9d2f05
+Revises: a3d6e0f4b812
+Create Date: 2026-10-19 11:48:05.127733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71e4a9d2f05'
+down_revision = 'a3d6e0f4b812'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    op.execute('UPDATE "transaction" SET updated_at = CURRENT_TIMESTAMP')
+
+
+def downgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,39 @@
+"""add ReceiptFile model for deduplicated receipts
+
+Revision ID: d4b8f1a6c390
+Revises: c71e4a9d2f05
+Create Date: 2026-10-19 12:31:54.902214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b8f1a6c390'
+down_revision = 'c71e4a9d2f05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('receipt_file',
+    sa.Column('filename', sa.String(length=200), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('filename')
+    )
+
+    # Существующие файлы получают столько ссылок, сколько транзакций на них
+    # указывает
+    op.execute(
+        'INSERT INTO receipt_file (filename, ref_count, created_at) '
+        'SELECT image_filename, COUNT(*), CURRENT_TIMESTAMP '
+        'FROM "transaction" WHERE image_filename IS NOT NULL '
+        'GROUP BY image_filename'
+    )
+
+
+def downgrade():
+    op.drop_table('receipt_file')
@@ -0,0 +1,26 @@
+"""add index on Transaction.image_filename
+
+Revision ID: f2a9c7e31b64
+Revises: d4b8f1a6c390
+Create Date: 2026-10-19 13:07:41.226813
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a9c7e31b64'
+down_revision = 'd4b8f1a6c390'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_transaction_image_filename'), ['image_filename'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('transaction', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_transaction_image_filename'))